@@ -0,0 +1,409 @@
+"""
+BENCHMARKS FOR THE RECURSIVE MODEL CHANNEL
+Juan Felipe Gutierrez
+jufgutierrezgo@unal.edu.co
+
+Timing scripts for the most expensive stages of main_model.py. Each benchmark
+prints a table with the tessellation size and the execution time of every
+implementation. Run as:
+
+    python benchmark.py [benchmark_name]
+
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+import timeit
+
+# annotating a variable with a type-hint
+from typing import List
+
+import numpy as np
+
+import main_model
+
+
+def make_parameters_loop(
+    array_points: List[float],
+    no_points: int
+    ) -> List[float]:
+    """Reference implementation of make_parameters with a double loop per cell pair.
+
+    It is the original point by point version of the function, it is kept to
+    validate and measure the speedup of the vectorized implementation.
+
+    """
+    ew_par = np.zeros((2,no_points,no_points),dtype=np.float16)
+
+    for ini_point in range(0,no_points):
+
+        for end_point in range(ini_point+1,no_points):
+
+            if array_points[3,ini_point]!=array_points[3,end_point]:
+                wallinit = int(array_points[3,ini_point])
+                wallend = int(array_points[3,end_point])
+
+                ew_par[0,ini_point,end_point] = np.linalg.norm(array_points[0:3,ini_point]-array_points[0:3,end_point])
+                ew_par[0,end_point,ini_point]  = ew_par[0,ini_point,end_point]
+
+                ew_par[1,ini_point,end_point],ew_par[1,end_point,ini_point] = main_model.cos_2points(
+                    array_points[0:3,ini_point],main_model.NORMAL_VECTOR_WALL[wallinit],
+                    array_points[0:3,end_point],main_model.NORMAL_VECTOR_WALL[wallend])
+
+    return ew_par
+
+
+def bench_make_parameters(
+    size_room: List[float] = [2,2,2],
+    scale_factors: List[float] = [1/2,1/4,1/6,1/8,1/12],
+    max_loop_points: int = 400
+    ) -> None:
+    """Benchmark of the vectorized make_parameters against the double loop.
+
+    The loop version is only timed for tessellations with less than
+    max_loop_points cells, for bigger ones only the vectorized time is reported.
+
+    """
+    print("//------- benchmark make_parameters ----------//")
+    print("{:>8} {:>12} {:>12} {:>10} {:>10}".format("cells","loop[s]","vector[s]","speedup","equal"))
+
+    for scale_factor in scale_factors:
+        array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = main_model.tessellation(
+            size_room[0],size_room[1],size_room[2],scale_factor)
+
+        starttime = timeit.default_timer()
+        ew_par = main_model.make_parameters(array_points,size_room[0],size_room[1],size_room[2],no_xtick,no_ytick,no_ztick)
+        vector_time = timeit.default_timer() - starttime
+
+        if no_points <= max_loop_points:
+            starttime = timeit.default_timer()
+            ew_ref = make_parameters_loop(array_points,no_points)
+            loop_time = timeit.default_timer() - starttime
+            print("{:>8} {:>12.4f} {:>12.4f} {:>10.1f} {:>10}".format(
+                no_points,loop_time,vector_time,loop_time/vector_time,str(np.array_equal(ew_par,ew_ref))))
+        else:
+            print("{:>8} {:>12} {:>12.4f} {:>10} {:>10}".format(no_points,"-",vector_time,"-","-"))
+
+
+def bench_cir_engines(
+    size_room: List[float] = [2,2,2],
+    scale_factors: List[float] = [1/3,1/5],
+    k_reflec: int = 3,
+    oversample: int = main_model.HIST_OVERSAMPLE
+    ) -> None:
+    """Benchmark of the time-binned engine against the ray list of compute_cir.
+
+    For each reflection the relative L1 difference between the histograms of
+    both engines is reported, it validates compute_cir_histograms. The first
+    reflection matches to round-off. From the second one on, the difference
+    is the power of the paths merged in a sub-bin across a bin edge: with the
+    default rooms and oversample it is about 1e-3 for the second reflection
+    and below 7e-2 for the third one.
+
+    """
+    print("//------- benchmark cir engines --------------//")
+    print("{:>8} {:>12} {:>12} {:>10}   {}".format("cells","rays[s]","binned[s]","speedup","L1 diff per order"))
+
+    for scale_factor in scale_factors:
+        array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = main_model.tessellation(
+            size_room[0],size_room[1],size_room[2],scale_factor)
+        ew_par = main_model.make_parameters(array_points,size_room[0],size_room[1],size_room[2],no_xtick,no_ytick,no_ztick)
+
+        tx_pos = array_points[0:3,np.argmin(array_points[3,:]!=0)]
+        rx_pos = array_points[0:3,np.argmin(array_points[3,:]!=5)]
+        args = (1,tx_pos,rx_pos,array_points[0:3,:],array_points[3,:],ew_par,size_room[0],size_room[1],size_room[2],
+            no_xtick,no_ytick,no_ztick,init_index,1e-4,0.8,delta_A,k_reflec)
+
+        starttime = timeit.default_timer()
+        h_k = main_model.compute_cir(*args)
+        hist_ref,total_ref,time_scale = main_model.create_histograms(h_k,k_reflec,no_points)
+        ray_time = timeit.default_timer() - starttime
+
+        starttime = timeit.default_timer()
+        hist_bin,total_bin,time_scale = main_model.compute_cir_histograms(*args,oversample=oversample)
+        binned_time = timeit.default_timer() - starttime
+
+        diff = np.sum(np.abs(hist_ref-hist_bin),axis=0)/np.maximum(np.sum(hist_ref,axis=0),1e-300)
+        print("{:>8} {:>12.4f} {:>12.4f} {:>10.1f}   {}".format(
+            no_points,ray_time,binned_time,ray_time/binned_time,np.array2string(diff,precision=4)))
+
+
+def bench_freq_response(
+    size_room: List[float] = [2,2,2],
+    scale_factors: List[float] = [1/3,1/5],
+    k_reflec: int = 3,
+    no_freq: int = 40
+    ) -> None:
+    """Benchmark of the transfer-matrix frequency response against rfft of the histograms.
+
+    The magnitude of compute_freq_response is cross-checked with compute_freq
+    over the first no_freq frequencies, the difference is reported relative to
+    the DC value of each reflection.
+
+    """
+    print("//------- benchmark frequency response -------//")
+    print("{:>8} {:>12} {:>12} {:>10}   {}".format("cells","rfft[s]","matrix[s]","speedup","max |H| diff per order"))
+
+    for scale_factor in scale_factors:
+        array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = main_model.tessellation(
+            size_room[0],size_room[1],size_room[2],scale_factor)
+        ew_par = main_model.make_parameters(array_points,size_room[0],size_room[1],size_room[2],no_xtick,no_ytick,no_ztick)
+
+        tx_pos = array_points[0:3,np.argmin(array_points[3,:]!=0)]
+        rx_pos = array_points[0:3,np.argmin(array_points[3,:]!=5)]
+        args = (1,tx_pos,rx_pos,array_points[0:3,:],array_points[3,:],ew_par,size_room[0],size_room[1],size_room[2],
+            no_xtick,no_ytick,no_ztick,init_index,1e-4,0.8,delta_A,k_reflec)
+
+        starttime = timeit.default_timer()
+        h_k = main_model.compute_cir(*args)
+        hist_power_time,total_ht,time_scale = main_model.create_histograms(h_k,k_reflec,no_points)
+        hfreq,freq = main_model.compute_freq(hist_power_time,k_reflec)
+        rfft_time = timeit.default_timer() - starttime
+
+        starttime = timeit.default_timer()
+        hfreq_matrix,freq = main_model.compute_freq_response(*args,freq[:no_freq])
+        matrix_time = timeit.default_timer() - starttime
+
+        diff = np.max(np.abs(np.abs(hfreq_matrix)-hfreq[:no_freq,:]),axis=0)/np.maximum(hfreq[0,:],1e-300)
+        print("{:>8} {:>12.4f} {:>12.4f} {:>10.1f}   {}".format(
+            no_points,rfft_time,matrix_time,rfft_time/matrix_time,np.array2string(diff,precision=4)))
+
+
+def bench_toeplitz(
+    size_room: List[float] = [2,2,2],
+    scale_factors: List[float] = [1/5,1/10,1/20,1/30],
+    repeat: int = 5
+    ) -> None:
+    """Benchmark of the dP_ij*x product with the dense matrix and the ToeplitzOperator.
+
+    The dense matrix is built in float64 from the geometry, the same as the
+    operator, so the reported relative difference is the FFT round-off.
+
+    """
+    print("//------- benchmark toeplitz operator --------//")
+    print("{:>8} {:>12} {:>12} {:>10} {:>12}".format("cells","dense[s]","toeplitz[s]","speedup","rel. diff"))
+
+    for scale_factor in scale_factors:
+        store = main_model.tessellation_store(size_room[0],size_room[1],size_room[2],scale_factor,dtype=np.float64)
+        normals = store.normals[store.wall]
+        distance,cos_ini,cos_end = main_model.pair_parameters(store.coordinates,store.wall,normals,store.coordinates,store.wall,normals)
+        dP_ij = np.divide(0.8*store.delta_A*cos_ini*cos_end,np.pi*distance**2,out=np.zeros_like(distance),where=distance!=0)
+        operator = main_model.ToeplitzOperator(store.coordinates,store.wall,0.8,store.delta_A)
+        x = np.random.default_rng(0).random(store.no_points)
+
+        dense_time = timeit.timeit(lambda: dP_ij @ x,number=repeat)/repeat
+        toeplitz_time = timeit.timeit(lambda: operator @ x,number=repeat)/repeat
+        diff = np.max(np.abs(operator @ x - dP_ij @ x))/np.max(np.abs(dP_ij @ x))
+        
+        print("{:>8} {:>12.5f} {:>12.5f} {:>10.1f} {:>12.2e}".format(
+            store.no_points,dense_time,toeplitz_time,dense_time/toeplitz_time,diff))
+
+
+def bench_parallel_parameters(
+    size_room: List[float] = [2,2,2],
+    scale_factor: float = 1/20,
+    max_workers: int = None
+    ) -> None:
+    """Benchmark of make_parameters with a pool of 1..ncores processes.
+
+    Each parallel result is compared bitwise with the serial array.
+
+    """
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    
+    array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = main_model.tessellation(
+        size_room[0],size_room[1],size_room[2],scale_factor)
+    
+    print("//------- benchmark parallel make_parameters -//")
+    print("cells: "+str(no_points))
+    print("{:>8} {:>12} {:>10} {:>10}".format("workers","time[s]","speedup","equal"))
+
+    serial_time = None
+    for workers in range(1,max_workers+1):
+        starttime = timeit.default_timer()
+        ew_par = main_model.make_parameters(array_points,size_room[0],size_room[1],size_room[2],
+            no_xtick,no_ytick,no_ztick,workers=workers)
+        elapsed = timeit.default_timer() - starttime
+
+        if serial_time is None:
+            serial_time,ew_serial = elapsed,ew_par
+
+        print("{:>8} {:>12.4f} {:>10.2f} {:>10}".format(
+            workers,elapsed,serial_time/elapsed,str(np.array_equal(ew_par,ew_serial))))
+
+
+def bench_receivers(
+    size_room: List[float] = [2,2,2],
+    scale_factor: float = 1/5,
+    no_receivers: List[int] = [1,10,100],
+    k_reflec: int = 3
+    ) -> None:
+    """Benchmark of compute_cir_receivers against one compute_cir_histograms per receiver.
+
+    The receivers are the cells of the floor, the L1 difference between both
+    results is reported relative to the total power of the receivers. It is
+    not zero because the sub-bins of the batch are aligned to the first line
+    of sight and those of each compute_cir_histograms to its own one.
+
+    """
+    array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = main_model.tessellation(
+        size_room[0],size_room[1],size_room[2],scale_factor)
+    ew_par = main_model.make_parameters(array_points,size_room[0],size_room[1],size_room[2],no_xtick,no_ytick,no_ztick)
+    points,wall_label = array_points[0:3,:],array_points[3,:]
+    tx_pos = points[:,np.argmin(wall_label!=0)]
+    floor = np.nonzero(wall_label==5)[0]
+    
+    print("//------- benchmark batched receivers --------//")
+    print("cells: "+str(no_points))
+    print("{:>10} {:>12} {:>12} {:>10} {:>12}".format("receivers","loop[s]","batch[s]","speedup","rel. diff"))
+
+    for no_rx in no_receivers:
+        rx_index = floor[np.linspace(0,len(floor)-1,min(no_rx,len(floor))).astype(int)]
+        receivers = main_model.make_receivers(points[:,rx_index].T,[0,0,1],1e-4,np.pi/2)
+
+        starttime = timeit.default_timer()
+        hist_loop = np.stack([main_model.compute_cir_histograms(1,tx_pos,points[:,rx],points,wall_label,ew_par,
+            size_room[0],size_room[1],size_room[2],no_xtick,no_ytick,no_ztick,init_index,1e-4,0.8,delta_A,k_reflec)[0]
+            for rx in rx_index])
+        loop_time = timeit.default_timer() - starttime
+
+        starttime = timeit.default_timer()
+        hist_batch = main_model.compute_cir_receivers(1,tx_pos,receivers,points,wall_label,ew_par,
+            size_room[0],size_room[1],size_room[2],0.8,delta_A,k_reflec)[0]
+        batch_time = timeit.default_timer() - starttime
+
+        diff = np.sum(np.abs(hist_loop-hist_batch))/np.sum(hist_loop)
+        print("{:>10} {:>12.4f} {:>12.4f} {:>10.1f} {:>12.2e}".format(
+            len(rx_index),loop_time,batch_time,loop_time/batch_time,diff))
+
+
+def bench_backends(
+    size_room: List[float] = [2,2,2],
+    scale_factor: float = 1/6,
+    k_reflec: int = 3,
+    repeat: int = 3
+    ) -> None:
+    """Benchmark of the kernels of each backend available (numpy and numba).
+
+    The first call of every kernel is not timed, so the numba compilation
+    time is excluded. The results are compared with the numpy backend.
+
+    """
+    array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = main_model.tessellation(
+        size_room[0],size_room[1],size_room[2],scale_factor)
+    coordinates,wall = array_points[0:3,:],array_points[3,:].astype(int)
+    normals = np.array(main_model.NORMAL_VECTOR_WALL,dtype=np.float64)[wall]
+
+    rng = np.random.default_rng(0)
+    dP_ij = rng.random((no_points,no_points)).astype(np.float32)
+    delay_ij = (rng.random((no_points,no_points))*1e-8).astype(np.float32)
+    power = rng.random(2**22).astype(np.float32)
+    delay = (rng.random(len(power))*6e-8).astype(np.float32)
+    cells = rng.integers(0,no_points,no_points)
+
+    inputs = {
+        "pair_parameters": (coordinates,wall,normals,coordinates,wall,normals),
+        "expand_paths": (power[:no_points],delay[:no_points],cells,dP_ij,delay_ij),
+        "bin_rays": (power,delay,np.float32(0),main_model.TIME_RESOLUTION,main_model.BINS_HIST),
+        }
+
+    backends = ["numpy"] + (["numba"] if importlib.util.find_spec("numba") is not None else [])
+    reference = main_model.get_kernels("numpy")
+
+    print("//------- benchmark kernel backends ----------//")
+    print("cells: "+str(no_points)+"  threads: "+str(os.cpu_count()))
+    print("{:>16} {:>8} {:>12} {:>10} {:>12}".format("kernel","backend","time[s]","speedup","max diff"))
+
+    for name,args in inputs.items():
+        expected = reference[name](*args)
+        numpy_time = None
+        
+        for backend in backends:
+            kernel = main_model.get_kernels(backend)[name]
+            result = kernel(*args)
+            elapsed = timeit.timeit(lambda: kernel(*args),number=repeat)/repeat
+            numpy_time = elapsed if numpy_time is None else numpy_time
+
+            result = result if isinstance(result,tuple) else (result,)
+            diff = max(float(np.max(np.abs(np.asarray(x,dtype=np.float64)-np.asarray(y,dtype=np.float64))))
+                for x,y in zip(result,expected if isinstance(expected,tuple) else (expected,)))
+            print("{:>16} {:>8} {:>12.5f} {:>10.1f} {:>12.2e}".format(name,backend,elapsed,numpy_time/elapsed,diff))
+
+    print("{:>16} {:>8} {:>12} {:>10}".format("compute_cir","backend","time[s]","speedup"))
+    ew_par = main_model.make_parameters(array_points,size_room[0],size_room[1],size_room[2],no_xtick,no_ytick,no_ztick)
+    tx_pos = coordinates[:,np.argmin(wall!=0)]
+    rx_pos = coordinates[:,np.argmin(wall!=5)]
+    args = (1,tx_pos,rx_pos,coordinates,wall,ew_par,size_room[0],size_room[1],size_room[2],
+        no_xtick,no_ytick,no_ztick,init_index,1e-4,0.8,delta_A,k_reflec)
+    numpy_time = None
+    
+    for backend in backends:
+        main_model.set_backend(backend)
+        main_model.compute_cir(*args,accumulator=main_model.HistogramAccumulator(k_reflec))
+        starttime = timeit.default_timer()
+        main_model.compute_cir(*args,accumulator=main_model.HistogramAccumulator(k_reflec))
+        elapsed = timeit.default_timer() - starttime
+        numpy_time = elapsed if numpy_time is None else numpy_time
+        print("{:>16} {:>8} {:>12.4f} {:>10.1f}".format("",backend,elapsed,numpy_time/elapsed))
+
+    main_model.set_backend("auto")
+
+
+def bench_import(
+    repeat: int = 5,
+    budget: float = 0.3,
+    lazy_modules: List[str] = ["matplotlib","mpl_toolkits","scipy","numba","fastdist"]
+    ) -> None:
+    """Benchmark of the import time of main_model, it guards the startup of short jobs.
+
+    Each import is timed in a new interpreter, against the import of numpy 
+    alone. It raises RuntimeError if the best time over numpy exceeds the 
+    budget [s] or if any of the lazy_modules is imported with main_model.
+
+    """
+    script = ("import sys,timeit\n"
+        "starttime = timeit.default_timer()\n"
+        "import {}\n"
+        "print(timeit.default_timer() - starttime)\n"
+        "print(' '.join(name for name in {} if name in sys.modules))")
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def import_time(module):
+        times = []
+        for i in range(repeat):
+            output = subprocess.run([sys.executable,"-c",script.format(module,lazy_modules)],cwd=directory,
+                capture_output=True,text=True,check=True).stdout.splitlines()
+            times.append(float(output[0]))
+        return min(times),output[1].split() if len(output) > 1 else []
+
+    numpy_time,_ = import_time("numpy")
+    model_time,loaded = import_time("main_model")
+
+    print("//------- benchmark import time --------------//")
+    print("{:>12} {:>12} {:>12} {:>12}".format("numpy[s]","model[s]","overhead[s]","budget[s]"))
+    print("{:>12.4f} {:>12.4f} {:>12.4f} {:>12.4f}".format(numpy_time,model_time,model_time-numpy_time,budget))
+    print("Lazy modules imported:",", ".join(loaded) if loaded else "none")
+
+    if loaded:
+        raise RuntimeError("main_model imports "+", ".join(loaded)+" at module load.")
+    if model_time - numpy_time > budget:
+        raise RuntimeError("The import of main_model exceeds the budget of "+str(budget)+" s.")
+
+
+BENCHMARKS = {
+    "make_parameters": bench_make_parameters,
+    "cir_engines": bench_cir_engines,
+    "freq_response": bench_freq_response,
+    "toeplitz": bench_toeplitz,
+    "parallel_parameters": bench_parallel_parameters,
+    "receivers": bench_receivers,
+    "backends": bench_backends,
+    "import": bench_import,
+    }
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -9,30 +9,35 @@ This software includes the following improvements:
 - The array_parameter is computed only with half matrix 
 - Was created a general reports about channel impulse reponse.
 - Was modified the equation reflection using 4 angles instead of 3 angles
+- The array_parameter is computed with numpy broadcasting by blocks of rows
 
 """
 import numpy as np
 import numpy
 import math
 import os
+import hashlib
+import importlib.util
+import json
+import tempfile
+import copy
+import multiprocessing
+import queue
+import threading
 
 # annotating a variable with a type-hint
-from typing import List, Tuple
+from typing import List, NamedTuple, Tuple
 
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d.axes3d as axes3d
+#matplotlib, mpl_toolkits and scipy.fft are imported by the functions that use them
 
 import fractions
 from fractions import Fraction
 
-from fastdist import fastdist
-
+import time
 import timeit
 
 from numpy.core.function_base import linspace
 
-from scipy.fft import rfft, rfftfreq
-
 # global variables
 
 #speed of light in [m/s]
@@ -43,12 +48,52 @@ TIME_RESOLUTION = 0.2e-9
 BINS_HIST = 300 
 #Array with normal vectors for each wall.
 NORMAL_VECTOR_WALL = [[0,0,-1],[0,1,0],[1,0,0],[0,-1,0],[-1,0,0],[0,0,1]]
+#Maximum distance [m] between a device and a wall plane to take the wall normal as the device normal
+WALL_TOLERANCE = 1e-6
+#Number of cell pairs evaluated at once in the make_parameters blocks
+PARAMETERS_BLOCK_SIZE = 2**22
+#Number of (cell,bin) pairs evaluated at once in the histogram propagation
+PROPAGATION_BLOCK_SIZE = 2**22
+#Number of sub-bins per histogram bin used to accumulate the delay of each hop
+HIST_OVERSAMPLE = 8
+#Relative tolerance to stop adding reflections when the number of reflections is not fixed
+REFLECTION_TOLERANCE = 1e-6
+#Maximum number of reflections computed when the number of reflections is not fixed
+MAX_REFLECTIONS = 50
+#Maximum memory in bytes of the ray lists of compute_cir when the number of reflections is "auto"
+CIR_MEMORY_BUDGET = 4*2**30
+#Maximum number of rays in each chunk yielded by iter_cir
+CIR_CHUNK_SIZE = 2**20
+#Number of (cell,receiver) pairs evaluated at once in coverage_map
+COVERAGE_BLOCK_SIZE = 2**22
+#Number of elements of the float64 temporaries of transfer_matrix
+TRANSFER_BLOCK_SIZE = 2**16
+#Data types of the precision policies ('float16', 'float32' or 'float64') compared by precision_report
+PRECISIONS = ["float16","float32","float64"]
+#Start method of the process pools, a forked process would inherit the threads of the numba backend
+POOL_START_METHOD = "spawn"
+#Backend of the hot kernels: 'auto' (numba if it is installed), 'numba' or 'numpy'
+KERNEL_BACKEND = "auto"
+#Policy for rays delayed beyond BINS_HIST: 'drop', 'clip' (last bin) or 'raise'
+HIST_OVERFLOW = "drop"
 #directory root of the project
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 #directory to save channel impulse response raw data
 CIR_PATH = ROOT_DIR + "/cir/"
 #directory to save histograms and graphs  
 REPORT_PATH = ROOT_DIR + "/report/"
+#directory to save the cached parameters arrays
+CACHE_PATH = ROOT_DIR + "/cache/"
+#maximum size in bytes of the parameters cache
+CACHE_MAX_BYTES = 16*2**30
+#age in seconds after which an incomplete entry or a temporary file of the cache is removed
+CACHE_STALE_AGE = 3600
+#format of the result files: 'npy' (memmap), 'npz' (compressed) or 'csv' (text)
+OUTPUT_FORMAT = "npy"
+#maximum number of pending tasks of a ResultWriter, submit blocks when it is full
+WRITER_QUEUE_SIZE = 8
+#version of the cells layout, it must change when tessellation changes the points
+TESSELLATION_VERSION = 2
 
 
 #Function to calculate angls between two vector position
@@ -68,6 +113,242 @@ def cos_2points(
     return cos_phi,cos_tetha
 
 
+def pair_parameters_numpy(
+    ini_points: List[float],
+    ini_wall: List[int],
+    ini_normal: List[float],
+    end_points: List[float],
+    end_wall: List[int],
+    end_normal: List[float]
+    ) -> Tuple[List[float],List[float],List[float]]:
+    """Function to compute distance and cosines between two sets of points.
+    
+    It is the broadcast version of cos_2points, every point in ini_points is 
+    paired with every point in end_points. Pairs of points on the same wall 
+    can not see each other and their parameters are zero.
+
+    Parameters:
+        ini_points: 2d-array (3xNi) with [x,y,z] coordinates of initial points
+        ini_wall: 1d-array with the wall label of initial points
+        ini_normal: 2d-array (Nix3) with the normal vector of initial points
+        end_points: 2d-array (3xNe) with [x,y,z] coordinates of end points
+        end_wall: 1d-array with the wall label of end points
+        end_normal: 2d-array (Nex3) with the normal vector of end points
+
+    Returns: A tuple with 2d-arrays (NixNe) with the next parameters
+        distance: euclidean distance between points
+        cos_ini: cosine of the angle at initial point respect to its normal
+        cos_end: cosine of the angle at end point respect to its normal
+
+    """
+
+    diff = end_points[:,np.newaxis,:] - ini_points[:,:,np.newaxis]
+    distance = np.sqrt(diff[0]**2 + diff[1]**2 + diff[2]**2)
+    
+    visible = ini_wall[:,np.newaxis] != end_wall[np.newaxis,:]
+    distance[~visible] = 0
+    unit_vlos = np.divide(diff,distance,out=np.zeros_like(diff),where=visible)
+
+    cos_ini = np.einsum('kij,ik->ij',unit_vlos,ini_normal)
+    cos_end = np.einsum('kij,jk->ij',-unit_vlos,end_normal)
+
+    return distance,cos_ini,cos_end
+
+
+def expand_paths_numpy(
+    power: List[float],
+    delay: List[float],
+    cells: List[int],
+    dP_ij: List[float],
+    delay_ij: List[float]
+    ) -> Tuple[List[float],List[float]]:
+    """Function to extend partial paths ending in cells to every cell.
+
+    Parameters:
+        power: 1d-array with the power of each partial path
+        delay: 1d-array with the time delay of each partial path
+        cells: 1d-array with the last cell of each partial path
+        dP_ij: 2d-array with power transfer factor between cells
+        delay_ij: 2d-array with time delay between cells
+
+    Returns: 2d-arrays (paths x cells) with the power and time delay of the new paths.
+
+    """
+    return power[:,np.newaxis]*dP_ij[cells,:],delay[:,np.newaxis] + delay_ij[cells,:]
+
+
+def bin_rays_numpy(
+    power: List[float],
+    delay: List[float],
+    delay_los: float,
+    resolution: float,
+    no_bins: int
+    ) -> List[float]:
+    """Function to accumulate the power of rays in bins of resolution referred to delay_los.
+
+    Rays before delay_los go to the first bin and rays beyond no_bins bins to 
+    the extra bin no_bins.
+
+    Returns: 1d-array with no_bins+1 bins.
+
+    """
+
+    bins = np.floor((delay - delay_los)/resolution)
+    bins = np.clip(bins,0,no_bins).astype(np.int64)
+
+    return np.bincount(bins,weights=power,minlength=no_bins+1)
+
+
+def numba_kernels() -> dict:
+    """Function to compile the kernels of the numba backend.
+
+    The kernels have the same signature of the numpy ones and their loops 
+    are parallel (prange). numba is imported when this function is called.
+
+    """
+
+    import numba
+
+    @numba.njit(parallel=True,cache=True)
+    def pair_parameters_numba(ini_points,ini_wall,ini_normal,end_points,end_wall,end_normal):
+        no_ini = ini_points.shape[1]
+        no_end = end_points.shape[1]
+        distance = np.zeros((no_ini,no_end))
+        cos_ini = np.zeros((no_ini,no_end))
+        cos_end = np.zeros((no_ini,no_end))
+
+        for i in numba.prange(no_ini):
+            for j in range(no_end):
+                if ini_wall[i] == end_wall[j]:
+                    continue
+
+                d0 = end_points[0,j] - ini_points[0,i]
+                d1 = end_points[1,j] - ini_points[1,i]
+                d2 = end_points[2,j] - ini_points[2,i]
+                dist = np.sqrt(d0**2 + d1**2 + d2**2)
+                distance[i,j] = dist
+                
+                if dist == 0:
+                    continue
+                
+                u0,u1,u2 = d0/dist,d1/dist,d2/dist
+                cos_ini[i,j] = u0*ini_normal[i,0] + u1*ini_normal[i,1] + u2*ini_normal[i,2]
+                cos_end[i,j] = -u0*end_normal[j,0] - u1*end_normal[j,1] - u2*end_normal[j,2]
+
+        return distance,cos_ini,cos_end
+
+    @numba.njit(parallel=True,cache=True)
+    def expand_paths_numba(power,delay,cells,dP_ij,delay_ij):
+        no_cells = dP_ij.shape[1]
+        next_power = np.empty((len(cells),no_cells),dtype=power.dtype)
+        next_delay = np.empty((len(cells),no_cells),dtype=delay.dtype)
+
+        for i in numba.prange(len(cells)):
+            for j in range(no_cells):
+                next_power[i,j] = power[i]*dP_ij[cells[i],j]
+                next_delay[i,j] = delay[i] + delay_ij[cells[i],j]
+
+        return next_power,next_delay
+
+    @numba.njit(parallel=True,cache=True)
+    def bin_rays_numba(power,delay,delay_los,resolution,no_bins):
+        #the bins are computed in parallel and the powers are added in the 
+        #order of the rays, as np.bincount, so the result does not depend on the threads
+        bins = np.empty(len(power),dtype=np.int64)
+        for i in numba.prange(len(power)):
+            index = np.floor((delay[i] - delay_los)/resolution)
+            bins[i] = int(min(max(index,0),no_bins))
+
+        hist_power = np.zeros(no_bins+1)
+        for i in range(len(power)):
+            hist_power[bins[i]] += power[i]
+
+        return hist_power
+
+    def pair_parameters_kernel(ini_points,ini_wall,ini_normal,end_points,end_wall,end_normal):
+        return pair_parameters_numba(np.asarray(ini_points,dtype=np.float64),np.asarray(ini_wall,dtype=np.int64),
+            np.ascontiguousarray(ini_normal,dtype=np.float64),np.asarray(end_points,dtype=np.float64),
+            np.asarray(end_wall,dtype=np.int64),np.ascontiguousarray(end_normal,dtype=np.float64))
+
+    def bin_rays_kernel(power,delay,delay_los,resolution,no_bins):
+        #the delays are binned in the precision of the input, as in numpy
+        delay = np.asarray(delay)
+        return bin_rays_numba(np.asarray(power,dtype=np.float64),delay,delay.dtype.type(delay_los),
+            delay.dtype.type(resolution),no_bins)
+
+    def expand_paths_kernel(power,delay,cells,dP_ij,delay_ij):
+        return expand_paths_numba(np.asarray(power),np.asarray(delay),np.asarray(cells,dtype=np.int64),
+            np.asarray(dP_ij),np.asarray(delay_ij))
+
+    return {"pair_parameters":pair_parameters_kernel,"expand_paths":expand_paths_kernel,"bin_rays":bin_rays_kernel}
+
+
+#Kernels of each backend, they are created by get_kernels the first time they are used
+KERNELS = {}
+
+
+def get_kernels(backend: str = None) -> dict:
+    """Function to get the kernels of a backend, by default KERNEL_BACKEND.
+
+    Returns: A dict with the pair_parameters, expand_paths and bin_rays kernels.
+
+    """
+
+    backend = KERNEL_BACKEND if backend is None else backend
+    if backend == "auto":
+        backend = "numba" if importlib.util.find_spec("numba") is not None else "numpy"
+
+    if backend not in KERNELS:
+        if backend == "numpy":
+            KERNELS[backend] = {"pair_parameters":pair_parameters_numpy,"expand_paths":expand_paths_numpy,"bin_rays":bin_rays_numpy}
+        elif backend == "numba":
+            KERNELS[backend] = numba_kernels()
+        else:
+            raise ValueError("Unknown kernel backend: "+str(backend))
+
+    return KERNELS[backend]
+
+
+def set_backend(backend: str) -> None:
+    """Function to select the backend of the kernels: 'auto', 'numba' or 'numpy'."""
+
+    global KERNEL_BACKEND
+    
+    if backend not in ["auto","numba","numpy"]:
+        raise ValueError("Unknown kernel backend: "+str(backend))
+    if backend == "numba" and importlib.util.find_spec("numba") is None:
+        raise ImportError("The numba backend needs the numba package.")
+
+    KERNEL_BACKEND = backend
+
+
+def pair_parameters(
+    ini_points: List[float],
+    ini_wall: List[int],
+    ini_normal: List[float],
+    end_points: List[float],
+    end_wall: List[int],
+    end_normal: List[float]
+    ) -> Tuple[List[float],List[float],List[float]]:
+    """Function to compute distance and cosines between two sets of points.
+    
+    It is computed by the kernel of the selected backend, see pair_parameters_numpy.
+
+    """
+    return get_kernels()["pair_parameters"](ini_points,ini_wall,ini_normal,end_points,end_wall,end_normal)
+
+
+def expand_paths(
+    power: List[float],
+    delay: List[float],
+    cells: List[int],
+    dP_ij: List[float],
+    delay_ij: List[float]
+    ) -> Tuple[List[float],List[float]]:
+    """Function to extend partial paths to every cell with the kernel of the selected backend, see expand_paths_numpy."""
+    return get_kernels()["expand_paths"](power,delay,cells,dP_ij,delay_ij)
+
+
 
 def led_pattern(m: float) -> None:
     """Function to create a 3d radiation pattern of the LED source.
@@ -82,6 +363,9 @@ def led_pattern(m: float) -> None:
         
     """
 
+    import matplotlib.pyplot as plt
+    import mpl_toolkits.mplot3d.axes3d as axes3d
+
     theta, phi = np.linspace(0, 2 * np.pi, 40), np.linspace(0,np.pi/2, 40)
     THETA, PHI = np.meshgrid(theta, phi)
     R = (m+1)/(2*np.pi)*np.cos(PHI)**m
@@ -98,36 +382,73 @@ def led_pattern(m: float) -> None:
     return 0
 
 
-def tessellation(
+class PointStore(NamedTuple):
+    """Compact structure-of-arrays with the cells of the tessellation.
+
+    Attributes:
+        coordinates: 2d-array (3xNc) with [x,y,z] coordinates of each cell.
+        wall: 1d-array (uint8) with the wall label of each cell.
+        init_index: 1d-array with start index for each wall inside of coordinates, 
+            the last item is the number of cells.
+        normals: 2d-array (6x3) with the normal vector of each wall.
+        no_xtick,no_ytick,no_ztick: Number of divisions in each axe.
+        delta_L: cell side length in the model
+        delta_A: cell area in the model
+
+    """
+    coordinates: np.ndarray
+    wall: np.ndarray
+    init_index: np.ndarray
+    normals: np.ndarray
+    no_xtick: int
+    no_ytick: int
+    no_ztick: int
+    delta_L: float
+    delta_A: float
+
+    @property
+    def no_points(self) -> int:
+        return len(self.wall)
+
+
+def wall_grid(
+    outer: List[float],
+    inner: List[float]
+    ) -> Tuple[List[float],List[float]]:
+    """Function to expand two axes of a wall in the order of the tessellation loops.
+    
+    The inner axe changes faster than the outer one, as in the nested loops
+    'for j in outer: for i in inner'.
+
+    """
+    return np.repeat(outer,len(inner)),np.tile(inner,len(outer))
+
+
+def tessellation_store(
     x_lim: float,
     y_lim: float,
     z_lim: float,
-    scale_factor:float
-    ) -> Tuple[List[float], int, int, int, int, float, int]:
-    """Function to calculate the coordinates [x,y,z] of every points.
+    scale_factor: float,
+    dtype: type = np.float32
+    ) -> PointStore:
+    """Function to calculate the coordinates [x,y,z] of every cell in a compact store.
     
     It assumes a rectangular room and each of ones of walls are splitted in small 
-    square cells. The centroid of each small cell represents a point coordinates 
-    that will be returned. Is also returned the number of points and the number of 
-    division in each axe. Using a scale factor is possible modify the number of 
-    cells used in the model.
+    square cells. The centroid of each small cell represents a point coordinates. 
+    Each wall is generated as a whole grid, the order of the cells inside of each 
+    wall is the same of the tessellation function.
 
     Paramteres:
         x_lim: lenght of rectangular room in x-axe
         y_lim: lenght of rectangular room in y-axe
         z_lim: lenght of rectangular room in z-axe 
         scale_factor: scale factor
+        dtype: data type of the coordinates 
 
-    Returns: A tuple with the follow parameters:
-        array_points = 2d-array (3xNc) with [X,Y,Z] coordinates of each points.
-        no_xtick,no_ytick,no_ztick: Number of divisions in each axe.
-        init_index: 1d-array with start index for each wall inside of array_points.
-        delta_A: cell area in the model
-        no_points: number of points (or cells) in the model 
+    Returns: A PointStore with coordinates, wall labels, offsets and normals.
     
     """
 
-
     print("//****** Tessellation *******//")
     x_num = fractions.Fraction(str(x_lim)).numerator
     x_den = fractions.Fraction(str(x_lim)).denominator
@@ -173,79 +494,182 @@ def tessellation(
     no_xtick = int(x_lim/delta_L)
     no_ytick = int(y_lim/delta_L)
     no_ztick = int(z_lim/delta_L)
+    
+    x_up = delta_L/2 + np.arange(no_xtick)*delta_L
+    y_up = delta_L/2 + np.arange(no_ytick)*delta_L
+    x_down = x_lim - delta_L/2 - np.arange(no_xtick)*delta_L
+    z_down = z_lim - delta_L/2 - np.arange(no_ztick)*delta_L
+
+    #Cells are ordered as (x,y) in walls 0 and 5, (z,x) in walls 1 and 3 and (z,y) in walls 2 and 4
+    ew0_x,ew0_y = wall_grid(x_up,y_up)
+    ew1_z,ew1_x = wall_grid(z_down,x_down)
+    ew2_z,ew2_y = wall_grid(z_down,y_up)
+
+    walls = [
+        [ew0_x,ew0_y,np.full(len(ew0_x),z_lim)],
+        [ew1_x,np.zeros(len(ew1_x)),ew1_z],
+        [np.zeros(len(ew2_y)),ew2_y,ew2_z],
+        [ew1_x,np.full(len(ew1_x),y_lim),ew1_z],
+        [np.full(len(ew2_y),x_lim),ew2_y,ew2_z],
+        [ew0_x,ew0_y,np.zeros(len(ew0_x))]
+        ]
+
+    init_index = np.zeros(7,dtype=np.int64)
+    init_index[1:] = np.cumsum([len(wall[0]) for wall in walls])
+
+    coordinates = np.concatenate([np.array(wall,dtype=dtype) for wall in walls],axis=1)
+    wall = np.repeat(np.arange(6,dtype=np.uint8),np.diff(init_index))
+    
+    print("The total number of points is: ",len(wall))
+    print("//-------- points array created --------------//")
+    
+    return PointStore(coordinates,wall,init_index,np.array(NORMAL_VECTOR_WALL,dtype=dtype),
+        no_xtick,no_ytick,no_ztick,delta_L,delta_A)
+
+
+def tessellation(
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    scale_factor:float,
+    dtype: type = np.float64
+    ) -> Tuple[List[float], int, int, int, int, float, int]:
+    """Function to calculate the coordinates [x,y,z] of every points.
+    
+    It assumes a rectangular room and each of ones of walls are splitted in small 
+    square cells. The centroid of each small cell represents a point coordinates 
+    that will be returned. Is also returned the number of points and the number of 
+    division in each axe. Using a scale factor is possible modify the number of 
+    cells used in the model. The points are created by tessellation_store.
+
+    Paramteres:
+        x_lim: lenght of rectangular room in x-axe
+        y_lim: lenght of rectangular room in y-axe
+        z_lim: lenght of rectangular room in z-axe 
+        scale_factor: scale factor
+        dtype: data type of array_points
+
+    Returns: A tuple with the follow parameters:
+        array_points = 2d-array (4xNc) with [X,Y,Z] coordinates and wall label of each points.
+        no_xtick,no_ytick,no_ztick: Number of divisions in each axe.
+        init_index: 1d-array with start index for each wall inside of array_points.
+        delta_A: cell area in the model
+        no_points: number of points (or cells) in the model 
+    
+    """
+
+    store = tessellation_store(x_lim,y_lim,z_lim,scale_factor,dtype=dtype)
+    
+    array_points = np.concatenate((store.coordinates,store.wall[np.newaxis,:]),axis=0)
+    init_index = store.init_index[:6].astype(np.float64)
+
+    return [array_points,store.no_xtick,store.no_ytick,store.no_ztick,init_index,store.delta_A,store.no_points]
 
-    ew0_points = np.zeros((4,no_xtick*no_ytick))
-    ew1_points = np.zeros((4,no_ztick*no_xtick))
-    ew2_points = np.zeros((4,no_ztick*no_ytick))
-    ew3_points = np.zeros((4,no_ztick*no_xtick))
-    ew4_points = np.zeros((4,no_ztick*no_ytick))
-    ew5_points = np.zeros((4,no_xtick*no_ytick))
+#MCM
+def lcm(num1: float, num2: float,num3: float) -> float: 
+    return abs(num1*num2*num3) // math.gcd(num3,math.gcd(num1, num2))
 
-    #Init_index define the index where each point in parameters start, eg. ew_0 start in index 0, and ew_1 in no_xtick*no_ytick index
-    init_index = np.zeros(6)
-    points = [ew0_points,ew1_points,ew2_points,ew3_points,ew4_points,ew5_points]
 
+def fill_parameters_rows(
+    ew_par: List[float],
+    coordinates: List[float],
+    wall: List[int],
+    normals: List[float],
+    ini_point: int,
+    end_point: int
+    ) -> None:
+    """Function to fill a block of rows [ini_point:end_point] of the parameters array.
     
+    Only the upper band [ini:end, ini:] is computed, the lower band [ini:, ini:end] 
+    is its transpose. Bands of different blocks do not overlap, so the blocks 
+    can be filled in any order or at the same time.
+
+    """
+
+    distance,cos_ini,cos_end = pair_parameters(
+        coordinates[:,ini_point:end_point],wall[ini_point:end_point],normals[ini_point:end_point],
+        coordinates[:,ini_point:],wall[ini_point:],normals[ini_point:])
+
+    ew_par[0,ini_point:end_point,ini_point:] = distance
+    ew_par[0,ini_point:,ini_point:end_point] = distance.T
+    ew_par[1,ini_point:end_point,ini_point:] = cos_ini
+    ew_par[1,ini_point:,ini_point:end_point] = cos_end.T
 
-    for i in range(1,6):
-        init_index[i] = int(len(points[i-1][0,:]) + init_index[i-1])
+
+#State of each process of the make_parameters pool, it is set by init_parameters_worker
+PARAMETERS_WORKER = {}
+
+
+def init_parameters_worker(
+    target: dict,
+    coordinates: List[float],
+    wall: List[int],
+    normals: List[float]
+    ) -> None:
+    """Function to attach a pool process to the memmap output of make_parameters."""
     
-    counter_cell = 0
+    ew_par = np.memmap(target["filename"],dtype=target["dtype"],mode="r+",offset=target["offset"],shape=target["shape"])
 
-    for j in range(0,no_xtick):
-        for i in range(0,no_ytick):
-            ew0_points[0,counter_cell] = delta_L/2 + j*delta_L
-            ew0_points[1,counter_cell] = delta_L/2 + i*delta_L         
-            ew0_points[2,counter_cell] = z_lim
-            ew0_points[3,counter_cell] = 0         
+    PARAMETERS_WORKER.update({"ew_par":ew_par,"coordinates":coordinates,"wall":wall,"normals":normals})
 
-            ew5_points[0,counter_cell] = delta_L/2 + j*delta_L
-            ew5_points[1,counter_cell] = delta_L/2 + i*delta_L         
-            ew5_points[2,counter_cell] = 0
-            ew5_points[3,counter_cell] = 5         
-            counter_cell += 1
 
-    counter_cell = 0
+def parameters_worker(rows: Tuple[int,int]) -> None:
+    """Function to fill a block of rows in a pool process."""
+    
+    fill_parameters_rows(PARAMETERS_WORKER["ew_par"],PARAMETERS_WORKER["coordinates"],PARAMETERS_WORKER["wall"],
+        PARAMETERS_WORKER["normals"],rows[0],rows[1])
+    
+    PARAMETERS_WORKER["ew_par"].flush()
 
-    for j in range(0,no_ztick):
-        for i in range(0,no_xtick):
-            ew1_points[0,counter_cell] = x_lim - delta_L/2 - i*delta_L
-            ew1_points[1,counter_cell] = 0
-            ew1_points[2,counter_cell] = z_lim - delta_L/2 - j*delta_L
-            ew1_points[3,counter_cell] = 1        
-            
-            ew3_points[0,counter_cell] = x_lim - delta_L/2 - i*delta_L
-            ew3_points[1,counter_cell] = y_lim
-            ew3_points[2,counter_cell] = z_lim - delta_L/2 - j*delta_L
-            ew3_points[3,counter_cell] = 3         
-            counter_cell += 1
 
+def fill_parameters_parallel(
+    ew_par: List[float],
+    coordinates: List[float],
+    wall: List[int],
+    normals: List[float],
+    block_rows: int,
+    workers: int
+    ) -> None:
+    """Function to fill the parameters array with a pool of processes.
     
-    counter_cell = 0
+    The blocks of rows are distributed between the processes, which write 
+    directly in the file of ew_par, so it must be a memmap with a file. No 
+    copy of the array is made.
 
-    for j in range(0,no_ztick):
-        for i in range(0,no_ytick):
-            ew2_points[0,counter_cell] = 0
-            ew2_points[1,counter_cell] = delta_L/2 + i*delta_L/2
-            ew2_points[2,counter_cell] = z_lim - delta_L/2 - j*delta_L
-            ew2_points[3,counter_cell] = 2        
-            
-            ew4_points[0,counter_cell] = x_lim
-            ew4_points[1,counter_cell] = delta_L/2 + i*delta_L/2
-            ew4_points[2,counter_cell] = z_lim - delta_L/2 - j*delta_L
-            ew4_points[3,counter_cell] = 4        
-            counter_cell += 1
-
-    no_points=2*no_xtick*no_ytick + 2*no_ztick*no_xtick + 2*no_ztick*no_ytick
-    print("The total number of points is: ",no_points)
-    print("//-------- points array created --------------//")
-    #print(ew0_points)
-    #print(ew5_points)
-    return [np.concatenate((ew0_points,ew1_points,ew2_points,ew3_points,ew4_points,ew5_points),axis=1),no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points]
+    """
 
-#MCM
-def lcm(num1: float, num2: float,num3: float) -> float: 
-    return abs(num1*num2*num3) // math.gcd(num3,math.gcd(num1, num2))
+    if not isinstance(ew_par,np.memmap) or ew_par.filename is None:
+        raise ValueError("The parallel make_parameters writes in a file, out must be a memmap.")
+
+    no_points = len(wall)
+    ew_par.flush()
+    target = {"filename":ew_par.filename,"offset":ew_par.offset,"shape":ew_par.shape,"dtype":ew_par.dtype.str}
+
+    tiles = [(ini_point,min(ini_point+block_rows,no_points)) for ini_point in range(0,no_points,block_rows)]
+
+    with multiprocessing.get_context(POOL_START_METHOD).Pool(workers,initializer=init_parameters_worker,
+            initargs=(target,coordinates,wall,normals)) as pool:
+        for _ in pool.imap_unordered(parameters_worker,tiles):
+            pass
+
+
+def shared_parameters(
+    shape: Tuple[int,int,int],
+    dtype: type
+    ) -> List[float]:
+    """Function to create the zero output of the parallel make_parameters in a temporary file.
+    
+    The file is created in /dev/shm if it exists (memory), otherwise in the 
+    temporary directory. The caller removes it when the pool is finished, the 
+    array stays valid while it is mapped.
+
+    """
+
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    descriptor,temp_file = tempfile.mkstemp(suffix=".parameters",dir=directory)
+    os.close(descriptor)
+
+    return np.memmap(temp_file,dtype=dtype,mode="w+",shape=shape)
 
 
 def make_parameters(
@@ -255,7 +679,11 @@ def make_parameters(
     z_lim: float,
     no_xtick: int,
     no_ytick: int,
-    no_ztick: int
+    no_ztick: int,
+    block_rows: int = None,
+    out: List[float] = None,
+    workers: int = 1,
+    dtype: type = np.float16
     )-> List[float]:
 
     """This function creates an 3d-array with cross-parametes between points. 
@@ -272,6 +700,19 @@ def make_parameters(
         no_xtick: number of division in x-axe 
         no_ytick: number of division in y-axe 
         no_ztick: number of division in z-axe 
+        block_rows: number of rows computed at once, by default it is taken 
+            from PARAMETERS_BLOCK_SIZE
+        out: optional array (or memmap) with shape [2,no_points,no_points] and 
+            zero initialized to store the parameters, it must be a memmap if 
+            workers > 1
+        workers: number of processes used to fill the array, None uses every
+            core. The result is bitwise identical to the serial computation.
+            The processes write in out, or in an array mapped from a temporary 
+            file (see shared_parameters), so the array is not copied. The 
+            processes are started with POOL_START_METHOD, so a script that 
+            uses them needs the if __name__ == "__main__" guard.
+        dtype: data type of the array if out is not given, the parameters are 
+            computed in float64 and rounded to dtype
 
     Returns: Returns a 3d-array with distance and cos(tetha) parameters. The 
     shape of this array is [2,no_points,no_points].
@@ -290,29 +731,38 @@ def make_parameters(
 
     """
     no_points = 2*no_xtick*no_ytick + 2*no_ztick*no_xtick + 2*no_ztick*no_ytick
-    ew_par = np.zeros((2,no_points,no_points),dtype=np.float16)    
-
-    counter_points = 0
-
-    for ini_point in range(0,no_points):        
-
-        for end_point in range(ini_point+1,no_points):
-                               
-            if array_points[3,ini_point]==array_points[3,end_point]:
-                ew_par[0,ini_point,end_point] = 0
-                ew_par[1,ini_point,end_point] = 0
-            else:
-                #ew_par[0,ini_point,end_point] = math.dist(array_points[:,ini_point],array_points[:,end_point])
-                wallinit = int(array_points[3,ini_point])               
-                wallend = int(array_points[3,end_point])
-
-                ew_par[0,ini_point,end_point] = fastdist.euclidean(array_points[0:3,ini_point],array_points[0:3,end_point])                 
-                ew_par[0,end_point,ini_point]  = ew_par[0,ini_point,end_point]
 
-                ew_par[1,ini_point,end_point],ew_par[1,end_point,ini_point] = cos_2points(array_points[0:3,ini_point],NORMAL_VECTOR_WALL[wallinit],
-                array_points[0:3,end_point],NORMAL_VECTOR_WALL[wallend])
-                
-   
+    coordinates = np.asarray(array_points[0:3,:],dtype=np.float64)
+    wall = np.asarray(array_points[3,:]).astype(int)
+    normals = np.array(NORMAL_VECTOR_WALL,dtype=np.float64)[wall]
+
+    if block_rows is None:
+        block_rows = max(1,PARAMETERS_BLOCK_SIZE//no_points)
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    if out is not None:
+        ew_par = out
+    elif workers > 1:
+        ew_par = shared_parameters((2,no_points,no_points),dtype)
+    else:
+        ew_par = np.zeros((2,no_points,no_points),dtype=dtype)
+
+    if workers > 1:
+        #smaller tiles balance the work of the triangular bands between processes
+        block_rows = max(1,min(block_rows,-(-no_points//(8*workers))))
+        try:
+            fill_parameters_parallel(ew_par,coordinates,wall,normals,block_rows,workers)
+        finally:
+            #the temporary file is removed, the array stays mapped
+            if out is None:
+                os.remove(ew_par.filename)
+        if out is None:
+            ew_par = np.asarray(ew_par)
+    else:
+        for ini_point in range(0,no_points,block_rows):
+            fill_parameters_rows(ew_par,coordinates,wall,normals,ini_point,min(ini_point+block_rows,no_points))
 
     print("//------- parameters array created -----------//")
     #print(h_k[i])   
@@ -322,225 +772,2201 @@ def make_parameters(
     return ew_par
 
 
-def compute_cir(
-    m: float,
-    tx_pos: List[float],
-    rx_pos: List[float],
-    points: List[float],
-    wall_label: List[float],
-    parameters: List[float],
-    x_lim: float,
-    y_lim: float,
-    z_lim: float,
-    no_xtick: float,
-    no_ytick: float,
-    no_ztick: float,
-    init_index: float,
-    a_r: float,
-    rho: float,
-    delta_A: float,
-    k_reflec: float
-    ) -> List[float]:    
-    """ Function to compute the channel impulse response for each reflection. 
+class PackedParameters:
+    """Packed storage of the cross-parameters array between points.
     
-    Parameters:
-        m: lambertian number to tx emission
-        tx_pos: 1d-array with [x,y,z] tx position
-        rx_pos: 1d-array with [x,y,z] rx position
-        points: List with [x,y,z] cooridinates for every point in each wall
-        parameters: List with angle and distance between all points.  
-        x_lim,y_lim,z_lim: limits in room dimmensions
-        a_r: sensitive area in photodetector
-        no_xtick,no_ytick,no_ztick: number of division in each axes.
-
-    Returns: A list with 2d-array [power_ray,time_delay] collection for each 
-    refletion [h_0,h_1,...,h_k].
+    Only the wall-pair blocks which can see each other are stored, and each 
+    pair of walls is stored once (a<b) as a distance block. The cosine at a 
+    point of wall a toward a point of wall b is h_ab/distance, where h_ab is 
+    the height of the point of wall b over the plane of wall a, so only the 
+    height vectors are stored for the cosines. Same-wall blocks are zero.
 
+    The object is indexed like the dense array of make_parameters, e.g.
+    parameters[0,:,:], parameters[1,tx_index,:] or parameters[0,tx_index,rx_index].
 
     """
 
-    
-    #compute the total number of points (cells)
-    no_cells = len(points[0,:])
-
-    #area factor
-    area_factor = (2*x_lim*y_lim + 2*x_lim*z_lim + 2*y_lim*z_lim)/(delta_A*no_cells)
-
-    #define the wall of the tx_pos
-    tx_wall = wall_label[tx_pos]
-    
-
-    #define the wall of the rx_pos
-    rx_wall = wall_label[rx_pos]
-    
+    def __init__(
+        self,
+        array_points: List[float],
+        dtype: type = np.float32,
+        block_rows: int = None
+        ) -> None:
+        
+        coordinates = np.asarray(array_points[0:3,:],dtype=np.float64)
+        self.wall = np.asarray(array_points[3,:]).astype(int)
+        self.no_points = len(self.wall)
+        self.dtype = np.dtype(dtype)
+        self.shape = (2,self.no_points,self.no_points)
+        
+        #Cells of each wall are contiguous in array_points
+        self.init_index = np.searchsorted(self.wall,np.arange(7))
+        normals = np.array(NORMAL_VECTOR_WALL,dtype=np.float64)
 
-    for i in range(0,no_cells):
-        #print(np.transpose(tx_pos)-points[tx_wall][:,i])        
-        if np.allclose(np.transpose(tx_pos),points[:,i]):
-            tx_index_point = i
-            #print(i)
-            break
+        self.distance = {}
+        self.height = {}
+        
+        for wall_a in range(6):
+            cells_a = slice(self.init_index[wall_a],self.init_index[wall_a+1])
+            axe = np.argmax(np.abs(normals[wall_a]))
+            plane = coordinates[axe,self.init_index[wall_a]]
             
+            for wall_b in range(6):
+                if wall_a == wall_b:
+                    continue
+                
+                cells_b = slice(self.init_index[wall_b],self.init_index[wall_b+1])
+                self.height[wall_a,wall_b] = (normals[wall_a,axe]*(coordinates[axe,cells_b] - plane)).astype(self.dtype)
 
-    for i in range(0,no_cells):        
-        if np.allclose(np.transpose(rx_pos),points[:,i]):
-            rx_index_point = i
-            #print(i)
-            break
+                if wall_a < wall_b:
+                    self.distance[wall_a,wall_b] = self.pair_distance(coordinates[:,cells_a],coordinates[:,cells_b],block_rows)
 
-    
-    cos_phi = np.zeros((no_cells),dtype=np.float16)
-    dis2 = np.zeros((no_cells,no_cells),dtype=np.float16)
+        print("//------- packed parameters created ----------//")
 
-    dis2 = np.power(parameters[0,:,:],2)
-    
-    cos_phi = parameters[1,int(tx_index_point),:]
-    tx_power = (m+1)/(2*np.pi)*np.multiply(np.divide(1,dis2[tx_index_point,:],out=np.zeros((no_cells)), where=dis2[tx_index_point,:]!=0),np.power(cos_phi,m))
-    rx_wall_factor = a_r*parameters[1,int(rx_index_point),:]
 
-    h0_se = np.zeros((no_cells,2),dtype=np.float32)
-    h0_er = np.zeros((no_cells,2),dtype=np.float32)
+    def pair_distance(
+        self,
+        ini_points: List[float],
+        end_points: List[float],
+        block_rows: int = None
+        ) -> List[float]:
+        """Method to compute the distance block between the points of two walls."""
 
-    
-    #Impulse response between source and each cells 
-    h0_se[:,0] = np.multiply(area_factor*rho*delta_A*tx_power,parameters[1,:,int(tx_index_point)])
-    #Impulse response between receiver and each cells 
-    h0_er[:,0] = np.divide(np.multiply(parameters[1,:,int(rx_index_point)],rx_wall_factor),np.pi*dis2[rx_index_point,:],out=np.zeros((no_cells)), where=dis2[rx_index_point,:]!=0)
-    #Time delay between source and each cells 
-    h0_se[:,1] = parameters[0,tx_index_point,:]/SPEED_OF_LIGHT
-    #Time delay between receiver and each cells 
-    h0_er[:,1] = parameters[0,rx_index_point,:]/SPEED_OF_LIGHT
+        distance = np.zeros((ini_points.shape[1],end_points.shape[1]),dtype=self.dtype)
+        
+        if block_rows is None:
+            block_rows = max(1,PARAMETERS_BLOCK_SIZE//max(1,end_points.shape[1]))
 
+        for ini in range(0,ini_points.shape[1],block_rows):
+            diff = end_points[:,np.newaxis,:] - ini_points[:,ini:ini+block_rows,np.newaxis]
+            distance[ini:ini+block_rows,:] = np.sqrt(diff[0]**2 + diff[1]**2 + diff[2]**2)
 
-    dP_ij = np.zeros((no_cells,no_cells),np.float32)
-    dP_ij = np.divide(rho*delta_A*parameters[1,:,:]*np.transpose(parameters[1,:,:]),np.pi*dis2,out=np.zeros_like(dP_ij),where=dis2!=0) 
-    #dP_ij_1d = dP_ij.flatten()
-    #numpy.savetxt("dPij.csv", dP_ij[:,0], delimiter=",")
-    
+        return distance
 
-    h_k = []
-    hlast_er = []
-    
 
-    for i in range(k_reflec+1):
-        h_k.append(np.zeros((int(no_cells**i),2),np.float32))
-        hlast_er.append(np.zeros((int(no_cells**i),2),np.float32)) 
+    @property
+    def nbytes(self) -> int:
+        return sum(block.nbytes for block in self.distance.values()) + sum(h.nbytes for h in self.height.values())
 
-        if i == 0:           
 
-            h_k[i][0,0] = tx_power[int(rx_index_point)]*rx_wall_factor[int(tx_index_point)]
-            h_k[i][0,1] = parameters[0,int(tx_index_point),int(rx_index_point)]/SPEED_OF_LIGHT
+    def block(
+        self,
+        index: int,
+        wall_a: int,
+        rows: List[int],
+        wall_b: int,
+        cols: List[int]
+        ) -> List[float]:
+        """Method to get the parameter index between local rows of wall_a and local cols of wall_b."""
 
-            print("//------------- h0-computed ------------------//")            
-            numpy.savetxt(CIR_PATH+"h0.csv", h_k[i], delimiter=",")
+        if wall_a < wall_b:
+            distance = self.distance[wall_a,wall_b][np.ix_(rows,cols)]
+        else:
+            distance = self.distance[wall_b,wall_a][np.ix_(cols,rows)].T
 
-        elif i==1:
-            hlast_er[i][:,0] = h0_er[:,0]     
-            hlast_er[i][:,1] = h0_er[:,1]
+        if index == 0:
+            return distance
+        
+        return np.divide(self.height[wall_a,wall_b][cols][np.newaxis,:],distance,
+            out=np.zeros_like(distance),where=distance!=0)
 
-            h_k[i][:,0] = np.multiply(h0_se[:,0],h0_er[:,0]) 
-            h_k[i][:,1] = h0_se[:,1] + h0_er[:,1]
 
-            print("//------------- h1-computed ------------------//")
-            numpy.savetxt(CIR_PATH+"h1.csv", h_k[i], delimiter=",")
+    def __getitem__(self,key) -> List[float]:
+        """Method to index the packed array like the dense array of make_parameters.
+        
+        The block of every requested parameter, row and column is computed and 
+        indexed with the key remapped to the block, so the shape of the result 
+        follows the indexing rules of numpy (an index array after a slice, 
+        index arrays broadcast between them, ...).
+
+        """
+
+        if not isinstance(key,tuple):
+            key = (key,)
+        if len(key) > 3 or any(item is None or item is Ellipsis for item in key):
+            raise IndexError("PackedParameters only takes up to 3 integer, slice or array indexes.")
+        key = key + (slice(None),)*(3-len(key))
+        
+        #sorted indexes of each axe in the block and the key referred to the block
+        selected = []
+        local = []
+        for size,item in zip(self.shape,key):
+            if isinstance(item,slice):
+                selected.append(np.arange(size)[item])
+                local.append(slice(None))
+                continue
+
+            item = np.asarray(item)
+            if item.dtype == bool:
+                item = np.nonzero(item)[0]
+            item = np.where(item < 0,item + size,item)
+            if np.any((item < 0) | (item >= size)):
+                raise IndexError("Index out of bounds for axis with size "+str(size))
             
+            unique = np.unique(item)
+            selected.append(unique)
+            local.append(int(np.searchsorted(unique,item)) if item.ndim == 0 else np.searchsorted(unique,item))
 
-        else:
-            count_blocks = 0
-            #print(len(hlast_er[i-1][:,0]))
-            #print(len(hlast_er[i][:,0]))
-            for j in range(len(hlast_er[i-1][:,0])):
+        indexes,rows,cols = selected
+        output = np.zeros((len(indexes),len(rows),len(cols)),dtype=self.dtype)
 
-                index_dpij = int(j%no_cells)
+        for wall_a in np.unique(self.wall[rows]):
+            sel_rows = np.nonzero(self.wall[rows]==wall_a)[0]
+            
+            for wall_b in np.unique(self.wall[cols]):
+                if wall_a == wall_b:
+                    continue
                 
-                hlast_er[i][no_cells*j:int(no_cells*(j+1)),0] = hlast_er[i-1][j,0]*dP_ij[index_dpij,:]
-                hlast_er[i][no_cells*j:int(no_cells*(j+1)),1] = hlast_er[i-1][j,1] + parameters[0,index_dpij,:]/SPEED_OF_LIGHT                
+                sel_cols = np.nonzero(self.wall[cols]==wall_b)[0]
+                for position,index in enumerate(indexes):
+                    output[position][np.ix_(sel_rows,sel_cols)] = self.block(int(index),wall_a,rows[sel_rows]-self.init_index[wall_a],
+                        wall_b,cols[sel_cols]-self.init_index[wall_b])
 
-            len_last = len(hlast_er[i][:,0])
+        return output[tuple(local)]
 
-            for l in range(no_cells):
-                
-                lim_0 = int(l*(no_cells**(i-1)))
-                lim_1 = int((l+1)*(no_cells**(i-1)))
-                
-                #h_k[i][lim_0:lim_1,0] = h0_se[l,0]*[hlast_er[i][m,0] for m in range(l,len_last,no_cells)]
-                #h_k[i][lim_0:lim_1,1] = h0_se[l,1] + [hlast_er[i][m,1] for m in range(l,len_last,no_cells)]
 
-                #h_k[i][lim_0:lim_1,0] = h0_se[l,0]*hlast_er[i][lim_0:lim_1,0] 
-                #h_k[i][lim_0:lim_1,1] = h0_se[l,1] + hlast_er[i][lim_0:lim_1,1]
-                #print(h0_se[l,0])
-                #print([hlast_er[i][m,0] for m in range(l,len_last,no_cells)])
-                h_k[i][lim_0:lim_1,0] = np.multiply([hlast_er[i][m,0] for m in range(l,len_last,no_cells)],h0_se[l,0])
-                h_k[i][lim_0:lim_1,1] = h0_se[l,1] + [hlast_er[i][m,1] for m in range(l,len_last,no_cells)]
+    def to_dense(self) -> List[float]:
+        """Method to create the dense [2,no_points,no_points] array of make_parameters."""
+        return self[:,:,:]
 
-            print("//------------- h"+str(i)+"-computed ------------------//")      
-                 
-    return h_k
 
-#
-def create_histograms(
-    h_k: List[float],
-    k_reflec: int,
-    no_cells: int
-    ) -> Tuple[List[float],List[float],List[float]]:
-    """Function to create histograms from channel impulse response raw data. 
+class ToeplitzOperator:
+    """Implicit operator with the power transfer factor dP_ij between cells.
     
-    The channel impulse response raw data is a list with power and time delay 
-    of each ray. The histogram are created based on time resolution. 
+    On the uniform grid of the tessellation the factor between a cell of wall a 
+    and a cell of wall b only depends on the offset between cells along the 
+    axes shared by both walls, so each wall-pair block is (block-)Toeplitz. 
+    The operator stores only the generating kernel of each pair of walls (in 
+    frequency domain) and applies dP_ij*x with FFT convolutions along shared 
+    axes. Parallel walls cost O(N*log(N)) and perpendicular walls O(N**1.5).
 
-    Parameters:
-        h_k: list with channel impulse response [h_0,h_1,...,h_k]. 
+    If freq is given, the kernel is the transfer matrix G(f) = dP_ij*exp(-j2*pi*f*d_ij/c).
+    The factor is computed from the geometry in float64, it is the same of 
+    compute_link_terms without the float16 rounding of the parameters array.
+
+    """
+
+    def __init__(
+        self,
+        points: List[float],
+        wall_label: List[float],
+        rho: float,
+        delta_A: float,
+        freq: float = None
+        ) -> None:
+
+        points = np.asarray(points[0:3,:],dtype=np.float64)
+        wall = np.asarray(wall_label).astype(int)
+        self.no_points = len(wall)
+        self.shape = (self.no_points,self.no_points)
+        self.rho = rho
+        self.delta_A = delta_A
+        self.freq = freq
+        
+        self.grids = [self.wall_grid(points,wall,label) for label in range(6)]
+        
+        steps = [grid["step"] for grid in self.grids if grid["step"] is not None]
+        if not np.allclose(steps,steps[0]):
+            raise ValueError("The cells must be a uniform grid with the same step in every wall.")
+        self.delta_L = steps[0]
+
+        #the geometric kernels are kept to create the operator of other frequencies with at_freq
+        self.geometry = {}
+        for wall_a in range(6):
+            for wall_b in range(6):
+                if wall_a != wall_b and self.grids[wall_a]["perm"].size and self.grids[wall_b]["perm"].size:
+                    self.geometry[wall_a,wall_b] = self.pair_kernel(self.grids[wall_a],self.grids[wall_b])
+
+        self.kernels = {pair:self.kernel_spectrum(geometry,freq) for pair,geometry in self.geometry.items()}
+
+
+    def at_freq(self,freq: float) -> "ToeplitzOperator":
+        """Method to create the operator G(f) of another frequency (None for dP_ij).
+        
+        The grids and the geometric kernels are shared, only the spectra of 
+        the kernels are computed, with one FFT for each pair of walls.
+
+        """
+
+        operator = copy.copy(self)
+        operator.freq = freq
+        operator.kernels = {pair:self.kernel_spectrum(geometry,freq) for pair,geometry in self.geometry.items()}
+
+        return operator
+
+
+    @staticmethod
+    def wall_grid(
+        points: List[float],
+        wall: List[int],
+        wall_label: int
+        ) -> dict:
+        """Method to find the uniform grid of the cells of a wall.
+
+        Returns a dict with the in-plane axes (ascending), the normal axe, the 
+        plane coordinate, the origin and step of the grid, and perm, the 2d-array 
+        with the index of the cell in each grid position.
+
+        """
+        
+        cells = np.nonzero(wall==wall_label)[0]
+        normal = np.array(NORMAL_VECTOR_WALL[wall_label])
+        normal_axe = int(np.argmax(np.abs(normal)))
+        axes = [axe for axe in range(3) if axe != normal_axe]
+        grid = {"axes":axes,"normal_axe":normal_axe,"normal":normal,"step":None,"perm":np.zeros((0,0),dtype=int)}
+        
+        if len(cells) == 0:
+            return grid
+
+        coordinates = points[:,cells]
+        origin = np.min(coordinates[axes,:],axis=1)
+        
+        spacing = np.concatenate([np.diff(np.unique(coordinates[axe,:])) for axe in axes])
+        step = np.min(spacing) if len(spacing) else 1.0
+        
+        index = np.rint((coordinates[axes,:] - origin[:,np.newaxis])/step).astype(int)
+        perm = np.full(index.max(axis=1)+1,-1)
+        perm[index[0],index[1]] = cells
+
+        if np.any(perm < 0):
+            raise ValueError("The cells of wall "+str(wall_label)+" are not a complete uniform grid.")
+
+        grid.update({"plane":coordinates[normal_axe,0],"origin":dict(zip(axes,origin)),"step":step if len(spacing) else None,"perm":perm})
+        
+        return grid
+
+
+    def pair_kernel(
+        self,
+        source: dict,
+        target: dict
+        ) -> dict:
+        """Method to compute the geometric kernel between the cells of two walls.
+
+        The kernel is evaluated on every offset along the shared axes, and on 
+        every position along the axes of one wall only. The shared axes are the
+        first ones, they are transformed to frequency domain by kernel_spectrum.
+
+        """
+
+        shared = [axe for axe in source["axes"] if axe in target["axes"]]
+        source_only = [axe for axe in source["axes"] if axe not in shared]
+        target_only = [axe for axe in target["axes"] if axe not in shared]
+        
+        n_source = dict(zip(source["axes"],source["perm"].shape))
+        n_target = dict(zip(target["axes"],target["perm"].shape))
+        fft_shape = [n_source[axe] + n_target[axe] - 1 for axe in shared]
+
+        #delta is the vector from the source cell to the target cell, with dims (shared...,source_only,target_only)
+        delta = [None]*3
+        dims = len(shared) + 2 
+        for j,axe in enumerate(shared):
+            offset = np.arange(fft_shape[j]) - (n_source[axe] - 1)
+            delta[axe] = (target["origin"][axe] - source["origin"][axe] + offset*self.delta_L).reshape(
+                [-1 if k==j else 1 for k in range(dims)])
+        
+        for axe in source_only:
+            delta[axe] = (target["plane"] - source["origin"][axe] - np.arange(n_source[axe])*self.delta_L).reshape(
+                [-1 if k==dims-2 else 1 for k in range(dims)])
+        
+        for axe in target_only:
+            delta[axe] = (target["origin"][axe] + np.arange(n_target[axe])*self.delta_L - source["plane"]).reshape(
+                [-1 if k==dims-1 else 1 for k in range(dims)])
+
+        if source["normal_axe"] == target["normal_axe"]:
+            delta[source["normal_axe"]] = np.full([1]*dims,target["plane"] - source["plane"])
+
+        distance2 = delta[0]**2 + delta[1]**2 + delta[2]**2
+        cos_source = sum(delta[axe]*source["normal"][axe] for axe in range(3))
+        cos_target = -sum(delta[axe]*target["normal"][axe] for axe in range(3))
+        
+        kernel = np.divide(self.rho*self.delta_A*cos_source*cos_target,np.pi*distance2**2,
+            out=np.zeros(np.broadcast(cos_source,cos_target,distance2).shape),where=distance2!=0)
+        
+        return {"shared":shared,"source_only":source_only,"target_only":target_only,"fft_shape":fft_shape,
+            "kernel":kernel,"delay":np.sqrt(distance2)/SPEED_OF_LIGHT}
+
+
+    @staticmethod
+    def kernel_spectrum(
+        geometry: dict,
+        freq: float = None
+        ) -> dict:
+        """Method to transform a kernel of pair_kernel along the shared axes, for the frequency freq."""
+
+        axes = range(len(geometry["shared"]))
+        if freq is None:
+            spectrum = np.fft.rfftn(geometry["kernel"],s=geometry["fft_shape"],axes=axes)
+        else:
+            kernel = geometry["kernel"]*np.exp(-2j*np.pi*freq*geometry["delay"])
+            spectrum = np.fft.fftn(kernel,s=geometry["fft_shape"],axes=axes)
+
+        kernel = {key:geometry[key] for key in ["shared","source_only","target_only","fft_shape"]}
+        kernel["spectrum"] = spectrum
+
+        return kernel
+
+
+    def matvec(self,x: List[float]) -> List[float]:
+        """Method to compute dP_ij*x for a 1d-array x or a 2d-array (no_points x m)."""
+
+        x = np.asarray(x)
+        vector = x.ndim == 1
+        if vector:
+            x = x[:,np.newaxis]
+
+        dtype = np.result_type(x.dtype,np.float64 if self.freq is None else np.complex128)
+        y = np.zeros((self.no_points,x.shape[1]),dtype=dtype)
+
+        for (wall_a,wall_b),kernel in self.kernels.items():
+            source,target = self.grids[wall_a],self.grids[wall_b]
+            shared = kernel["shared"]
+            fft_axes = range(len(shared))
+            
+            #grid of the source with dims (shared...,source_only,m)
+            x_grid = x[source["perm"],:]
+            x_grid = np.transpose(x_grid,[source["axes"].index(axe) for axe in shared+kernel["source_only"]]+[2])
+            if not kernel["source_only"]:
+                x_grid = x_grid[...,np.newaxis,:]
+            
+            if self.freq is None:
+                x_spectrum = np.fft.rfftn(x_grid,s=kernel["fft_shape"],axes=fft_axes)
+            else:
+                x_spectrum = np.fft.fftn(x_grid,s=kernel["fft_shape"],axes=fft_axes)
+
+            y_spectrum = np.einsum('...ij,...ik->...jk',kernel["spectrum"],x_spectrum)
+
+            if self.freq is None:
+                y_grid = np.fft.irfftn(y_spectrum,s=kernel["fft_shape"],axes=fft_axes)
+            else:
+                y_grid = np.fft.ifftn(y_spectrum,s=kernel["fft_shape"],axes=fft_axes)
+
+            #valid part of the linear convolution, with dims (shared...,target_only,m)
+            n_source = dict(zip(source["axes"],source["perm"].shape))
+            n_target = dict(zip(target["axes"],target["perm"].shape))
+            y_grid = y_grid[tuple(slice(n_source[axe]-1,n_source[axe]-1+n_target[axe]) for axe in shared)]
+            if not kernel["target_only"]:
+                y_grid = y_grid[...,0,:]
+
+            order = shared + kernel["target_only"]
+            y_grid = np.transpose(y_grid,[order.index(axe) for axe in target["axes"]]+[2])
+            y[target["perm"],:] += y_grid
+
+        return y[:,0] if vector else y
+
+
+    def __matmul__(self,x: List[float]) -> List[float]:
+        return self.matvec(x)
+
+
+    def to_dense(self) -> List[float]:
+        """Method to create the dense (no_points x no_points) matrix of the operator."""
+        return self.matvec(np.eye(self.no_points))
+
+
+class CellIndex:
+    """Grid index to find the cell nearest to any position in O(1).
+    
+    The position is projected on the nearest wall plane and the cell is read 
+    from the uniform grid of that wall (see ToeplitzOperator.wall_grid), 
+    without comparing the position with every cell.
+
+    """
+
+    def __init__(
+        self,
+        points: List[float],
+        wall_label: List[float]
+        ) -> None:
+
+        self.points = np.asarray(points[0:3,:],dtype=np.float64)
+        self.wall = np.asarray(wall_label).astype(int)
+        
+        #plane of each wall, from its first cell
+        self.planes = np.full(6,np.nan)
+        labels,first = np.unique(self.wall,return_index=True)
+        for label,cell in zip(labels,first):
+            self.planes[label] = self.points[np.argmax(np.abs(NORMAL_VECTOR_WALL[label])),cell]
+        
+        #the grids are only needed by nearest, they need a complete uniform grid
+        self.grids = None
+
+
+    def nearest_wall(self,position: List[float]) -> List[int]:
+        """Method to get the label of the wall nearest to a position, or to a 2d-array (Nx3) of positions."""
+
+        position = np.asarray(position,dtype=np.float64)
+        single = position.ndim == 1
+        position = np.atleast_2d(position)
+
+        plane_distance = np.full((6,len(position)),np.inf)
+        for label in range(6):
+            if not np.isnan(self.planes[label]):
+                plane_distance[label] = np.abs(position[:,np.argmax(np.abs(NORMAL_VECTOR_WALL[label]))] - self.planes[label])
+
+        nearest_wall = np.argmin(plane_distance,axis=0)
+
+        return nearest_wall[0] if single else nearest_wall
+
+
+    def nearest(self,position: List[float]) -> List[int]:
+        """Method to get the index of the cell nearest to a position, or to a 2d-array (Nx3) of positions."""
+
+        if self.grids is None:
+            self.grids = [ToeplitzOperator.wall_grid(self.points,self.wall,label) for label in range(6)]
+
+        position = np.asarray(position,dtype=np.float64)
+        single = position.ndim == 1
+        position = np.atleast_2d(position)
+
+        nearest_wall = self.nearest_wall(position)
+        cells = np.zeros(len(position),dtype=np.int64)
+        
+        for label in np.unique(nearest_wall):
+            grid = self.grids[label]
+            selected = nearest_wall == label
+            step = 1.0 if grid["step"] is None else grid["step"]
+            index = [np.clip(np.rint((position[selected,axe] - grid["origin"][axe])/step).astype(np.int64),0,size-1) 
+                for axe,size in zip(grid["axes"],grid["perm"].shape)]
+            cells[selected] = grid["perm"][index[0],index[1]]
+
+        return cells[0] if single else cells
+
+
+def parameters_cache_key(
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    scale_factor: float,
+    dtype: type = np.float16
+    ) -> str:
+    """Function to compute the hash that identifies a parameters array in the cache."""
+
+    geometry = {
+        "x_lim":repr(float(x_lim)),
+        "y_lim":repr(float(y_lim)),
+        "z_lim":repr(float(z_lim)),
+        "scale_factor":repr(float(scale_factor)),
+        "dtype":np.dtype(dtype).name,
+        "tessellation_version":TESSELLATION_VERSION
+        }
+    
+    return hashlib.sha256(json.dumps(geometry,sort_keys=True).encode()).hexdigest()[:32]
+
+
+def file_checksum(path: str) -> str:
+    """Function to compute the sha256 checksum of a file by chunks."""
+
+    checksum = hashlib.sha256()
+    with open(path,"rb") as file:
+        for chunk in iter(lambda: file.read(2**24),b""):
+            checksum.update(chunk)
+    
+    return checksum.hexdigest()
+
+
+def evict_parameters_cache(
+    cache_path: str = CACHE_PATH,
+    max_bytes: int = CACHE_MAX_BYTES,
+    keep: str = None
+    ) -> List[str]:
+    """Function to remove the least recently used arrays until the cache fits in max_bytes.
+    
+    Incomplete entries (an array or a header alone) and temporary files left 
+    by interrupted writes are removed when they are older than CACHE_STALE_AGE, 
+    newer ones can belong to a write in progress in another process.
+
+    Parameters:
+        cache_path: directory of the parameters cache
+        max_bytes: maximum size in bytes of the cache
+        keep: key of an entry that must not be removed
+
+    Returns: A list with the keys of the removed entries.
+
+    """
+
+    entries = []
+    removed = []
+    now = time.time()
+
+    for name in os.listdir(cache_path):
+        key,extension = os.path.splitext(name)
+        path = os.path.join(cache_path,name)
+        stale = now - os.path.getmtime(path) > CACHE_STALE_AGE
+        
+        if extension == ".tmp" and stale:
+            os.remove(path)
+            continue
+        if extension == ".json" and stale and not os.path.exists(os.path.join(cache_path,key+".npy")):
+            os.remove(path)
+            removed.append(key)
+            continue
+        if extension != ".npy":
+            continue
+        
+        header_file = os.path.join(cache_path,key+".json")
+        if not os.path.exists(header_file):
+            if stale:
+                os.remove(path)
+                removed.append(key)
+            continue
+
+        entries.append([os.path.getmtime(header_file),os.path.getsize(os.path.join(cache_path,name)),key])
+
+    total_bytes = sum(entry[1] for entry in entries)
+
+    #the oldest used entries are removed first
+    for last_use,size,key in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if key == keep:
+            continue
+
+        os.remove(os.path.join(cache_path,key+".json"))
+        os.remove(os.path.join(cache_path,key+".npy"))
+        total_bytes -= size
+        removed.append(key)
+
+    return removed
+
+
+def cached_parameters(
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    scale_factor: float,
+    dtype: type = np.float16,
+    cache_path: str = CACHE_PATH,
+    max_bytes: int = CACHE_MAX_BYTES,
+    verify_checksum: bool = False,
+    workers: int = 1
+    ) -> List[float]:
+    """Function to get the parameters array of a room from the on-disk cache.
+    
+    The array of make_parameters is saved as a .npy file keyed by a hash of the 
+    room size, scale factor, dtype and tessellation version, and a .json header 
+    with the shape, size and checksum of the file. Later calls with the same 
+    geometry reopen the file as a read-only memmap. If the header does not match 
+    the file, the array is computed again. The least recently used arrays are 
+    removed when the cache is bigger than max_bytes.
+
+    Parameters:
+        x_lim,y_lim,z_lim: limits in room dimmensions
+        scale_factor: scale factor of the tessellation
+        dtype: data type of the parameters array
+        cache_path: directory of the parameters cache
+        max_bytes: maximum size in bytes of the cache
+        verify_checksum: if it is True the sha256 checksum of the file is 
+            checked when it is reopened, otherwise only its size and shape
+        workers: number of processes used by make_parameters when the array 
+            is not in the cache
+
+    Returns: A memmap with the 3d-array [2,no_points,no_points] of make_parameters.
+
+    """
+
+    os.makedirs(cache_path,exist_ok=True)
+    
+    key = parameters_cache_key(x_lim,y_lim,z_lim,scale_factor,dtype)
+    array_file = os.path.join(cache_path,key+".npy")
+    header_file = os.path.join(cache_path,key+".json")
+
+    if os.path.exists(header_file) and os.path.exists(array_file):
+        try:
+            with open(header_file) as file:
+                header = json.load(file)
+            parameters = np.load(array_file,mmap_mode="r")
+            valid = (os.path.getsize(array_file) == header["file_bytes"] and 
+                list(parameters.shape) == header["shape"] and parameters.dtype.name == header["dtype"])
+            if valid and verify_checksum:
+                valid = file_checksum(array_file) == header["checksum"]
+        except (json.JSONDecodeError,ValueError,OSError,KeyError,TypeError):
+            valid = False
+
+        if valid:
+            #the modification time of the header marks the last use of the entry
+            os.utime(header_file)
+            print("//------- parameters array from cache --------//")
+            return parameters
+
+        print("Cached parameters array "+key+" is corrupted, computing it again.")
+        os.remove(header_file)
+
+    array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = tessellation(x_lim,y_lim,z_lim,scale_factor)
+    
+    #the array and the header are written in unique temporary files and renamed 
+    #when they are complete, the header first so a visible array always has it
+    descriptor,temp_file = tempfile.mkstemp(suffix=".npy.tmp",prefix=key,dir=cache_path)
+    os.close(descriptor)
+    parameters = np.lib.format.open_memmap(temp_file,mode="w+",dtype=dtype,shape=(2,no_points,no_points))
+    make_parameters(array_points,x_lim,y_lim,z_lim,no_xtick,no_ytick,no_ztick,out=parameters,workers=workers)
+    parameters.flush()
+    del parameters
+
+    header = {
+        "x_lim":x_lim,"y_lim":y_lim,"z_lim":z_lim,"scale_factor":scale_factor,
+        "dtype":np.dtype(dtype).name,"tessellation_version":TESSELLATION_VERSION,
+        "shape":[2,no_points,no_points],"file_bytes":os.path.getsize(temp_file),
+        "checksum":file_checksum(temp_file)
+        }
+    descriptor,temp_header = tempfile.mkstemp(suffix=".json.tmp",prefix=key,dir=cache_path)
+    with os.fdopen(descriptor,"w") as file:
+        json.dump(header,file,indent=2)
+    os.replace(temp_header,header_file)
+    os.replace(temp_file,array_file)
+
+    evict_parameters_cache(cache_path,max_bytes,keep=key)
+
+    return np.load(array_file,mmap_mode="r")
+
+
+class Receivers(NamedTuple):
+    """Array of receivers evaluated in one propagation.
+
+    Attributes:
+        position: 2d-array (3xNr) with [x,y,z] position of each receiver.
+        normal: 2d-array (Nrx3) with the normal vector of each receiver.
+        area: 1d-array with the sensitive area [m^2] of each receiver.
+        fov: 1d-array with the half-angle field of view [rad] of each receiver.
+        gain: 1d-array with the gain of the optical concentrator of each receiver.
+
+    """
+    position: np.ndarray
+    normal: np.ndarray
+    area: np.ndarray
+    fov: np.ndarray
+    gain: np.ndarray
+
+    @property
+    def no_receivers(self) -> int:
+        return self.position.shape[1]
+
+    def take(self,index) -> "Receivers":
+        """Method to select a subset of receivers with an index, slice or mask."""
+        return Receivers(self.position[:,index],self.normal[index],self.area[index],self.fov[index],self.gain[index])
+
+    def fov_gain(self,cos_rx: List[float]) -> List[float]:
+        """Method to get the concentrator gain of each receiver for the incidence cosines cos_rx (... x Nr).
+
+        The gain is zero outside of the field of view or behind the receiver.
+
+        """
+        return np.where((cos_rx > 0) & (cos_rx >= np.cos(self.fov)),self.gain,0.0)
+
+
+def make_receivers(
+    position: List[float],
+    normal: List[float],
+    area: float,
+    fov: float,
+    concentrator: float = None
+    ) -> Receivers:
+    """Function to create Receivers from a list of positions.
+
+    The normal, area and fov are broadcast to every receiver, so a single 
+    value can be given for all of them. The normals are normalized. The gain 
+    of an ideal non-imaging concentrator is n**2/sin(fov)**2, without 
+    concentrator the gain is 1.
+
+    Parameters:
+        position: 2d-array (Nrx3) with [x,y,z] position of each receiver
+        normal: 1d-array [x,y,z] or 2d-array (Nrx3) with normal vectors
+        area: sensitive area [m^2], scalar or 1d-array
+        fov: half-angle field of view [rad], scalar or 1d-array
+        concentrator: refractive index n of the concentrator, None if there is 
+            no concentrator
+
+    Returns: A Receivers array.
+
+    """
+
+    position = np.atleast_2d(np.asarray(position,dtype=np.float64))
+    no_receivers = len(position)
+    normal = np.broadcast_to(np.asarray(normal,dtype=np.float64),(no_receivers,3))
+    normal = normal/np.linalg.norm(normal,axis=1)[:,np.newaxis]
+
+    fov = np.broadcast_to(np.asarray(fov,dtype=np.float64),(no_receivers,)).copy()
+    gain = np.ones(no_receivers) if concentrator is None else concentrator**2/np.sin(fov)**2
+
+    return Receivers(position.T.copy(),normal,
+        np.broadcast_to(np.asarray(area,dtype=np.float64),(no_receivers,)).copy(),fov,gain)
+
+
+def receiver_terms(
+    receivers: Receivers,
+    points: List[float],
+    wall_label: List[float],
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float]]:
+    """Function to compute the power and delay between every cell and every receiver.
+
+    The geometry is computed with pair_parameters, the receivers can be at any 
+    position inside of the room. Cells outside of the field of view of a 
+    receiver, or behind it, do not reach it.
+
+    Parameters:
+        receivers: Receivers array
+        points: List with [x,y,z] cooridinates for every point in each wall
+        wall_label: 1d-array with the wall label of each point
+        dtype: data type of the arrays, they are computed in float64
+
+    Returns:
+        er_power: 2d-array (cells x Nr) with the power factor between cells and receivers
+        er_delay: 2d-array (cells x Nr) with the time delay between cells and receivers
+
+    """
+
+    points = np.asarray(points[0:3,:],dtype=np.float64)
+    wall = np.asarray(wall_label).astype(int)
+    normals = np.array(NORMAL_VECTOR_WALL,dtype=np.float64)[wall]
+
+    #receivers do not belong to a wall, they can see every cell
+    with np.errstate(invalid="ignore"):
+        distance,cos_cell,cos_rx = pair_parameters(points,wall,normals,
+            receivers.position,np.full(receivers.no_receivers,-1),receivers.normal)
+
+    gain = receivers.fov_gain(cos_rx)
+    visible = (cos_cell > 0) & (gain > 0) & (distance != 0)
+    er_power = np.divide(cos_cell*receivers.area*gain*cos_rx,np.pi*distance**2,out=np.zeros_like(distance),where=visible)
+
+    return er_power.astype(dtype),(distance/SPEED_OF_LIGHT).astype(dtype)
+
+
+class Transmitters(NamedTuple):
+    """Array of transmitters (LEDs) evaluated in one propagation.
+
+    Attributes:
+        position: 2d-array (3xNt) with [x,y,z] position of each transmitter.
+        normal: 2d-array (Ntx3) with the normal vector of each transmitter.
+        lambert: 1d-array with the lambertian number of each transmitter.
+        power: 1d-array with the optical power [W] of each transmitter.
+
+    """
+    position: np.ndarray
+    normal: np.ndarray
+    lambert: np.ndarray
+    power: np.ndarray
+
+    @property
+    def no_transmitters(self) -> int:
+        return self.position.shape[1]
+
+
+def make_transmitters(
+    position: List[float],
+    normal: List[float],
+    lambert: float,
+    power: float
+    ) -> Transmitters:
+    """Function to create Transmitters from a list of positions.
+
+    The normal, lambertian number and power are broadcast to every 
+    transmitter, as in make_receivers. The normals are normalized.
+
+    Parameters:
+        position: 2d-array (Ntx3) with [x,y,z] position of each transmitter
+        normal: 1d-array [x,y,z] or 2d-array (Ntx3) with normal vectors
+        lambert: lambertian number, scalar or 1d-array
+        power: optical power [W], scalar or 1d-array
+
+    Returns: A Transmitters array.
+
+    """
+
+    position = np.atleast_2d(np.asarray(position,dtype=np.float64))
+    no_transmitters = len(position)
+    normal = np.broadcast_to(np.asarray(normal,dtype=np.float64),(no_transmitters,3))
+    normal = normal/np.linalg.norm(normal,axis=1)[:,np.newaxis]
+
+    return Transmitters(position.T.copy(),normal,
+        np.broadcast_to(np.asarray(lambert,dtype=np.float64),(no_transmitters,)).copy(),
+        np.broadcast_to(np.asarray(power,dtype=np.float64),(no_transmitters,)).copy())
+
+
+def transmitter_terms(
+    transmitters: Transmitters,
+    points: List[float],
+    wall_label: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    rho: float,
+    delta_A: float,
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float]]:
+    """Function to compute the power and delay between every transmitter and every cell.
+
+    It is the h0_se of source_terms computed from the geometry, for many 
+    transmitters at any position and with their own normal vector.
+
+    Parameters:
+        transmitters: Transmitters array
+        points: List with [x,y,z] cooridinates for every point in each wall
+        wall_label: 1d-array with the wall label of each point
+        x_lim,y_lim,z_lim: limits in room dimmensions
+        rho: reflectance of the walls
+        delta_A: cell area in the model
+        dtype: data type of the arrays, they are computed in float64
+
+    Returns:
+        se_power: 2d-array (cells x Nt) with the power between transmitters and cells
+        se_delay: 2d-array (cells x Nt) with the time delay between transmitters and cells
+
+    """
+
+    points = np.asarray(points[0:3,:],dtype=np.float64)
+    wall = np.asarray(wall_label).astype(int)
+    normals = np.array(NORMAL_VECTOR_WALL,dtype=np.float64)[wall]
+    no_cells = len(wall)
+
+    #area factor
+    area_factor = (2*x_lim*y_lim + 2*x_lim*z_lim + 2*y_lim*z_lim)/(delta_A*no_cells)
+
+    with np.errstate(invalid="ignore"):
+        distance,cos_tx,cos_cell = pair_parameters(transmitters.position,np.full(transmitters.no_transmitters,-1),
+            transmitters.normal,points,wall,normals)
+
+    visible = (cos_tx > 0) & (cos_cell > 0) & (distance != 0)
+    intensity = transmitters.power[:,np.newaxis]*(transmitters.lambert[:,np.newaxis]+1)/(2*np.pi)*np.power(
+        np.clip(cos_tx,0,None),transmitters.lambert[:,np.newaxis])
+    se_power = np.divide(area_factor*rho*delta_A*intensity*cos_cell,distance**2,out=np.zeros_like(distance),where=visible)
+
+    return se_power.T.astype(dtype),(distance.T/SPEED_OF_LIGHT).astype(dtype)
+
+
+def propagation_dtype(dtype: type) -> type:
+    """Function to get the data type of the rays of a precision policy.
+    
+    The powers of the rays are below the normal range of float16 (6e-5), so 
+    the float16 policy only applies to the points and parameters and the rays 
+    are propagated in float32.
+
+    """
+    return np.promote_types(dtype,np.float32).type
+
+
+def transfer_matrix(
+    parameters: List[float],
+    rho: float,
+    delta_A: float,
+    dtype: type = np.float32
+    ) -> List[float]:
+    """Function to compute the power transfer factor dP_ij between cells.
+    
+    The factor is computed in float64 and rounded to dtype, the factor 
+    rho*delta_A is too small to be multiplied in the precision of a float16 
+    parameters array. It is computed by blocks of rows, so the float64 
+    temporaries are about TRANSFER_BLOCK_SIZE elements.
+
+    """
+
+    no_cells = parameters.shape[1]
+    block_rows = max(1,TRANSFER_BLOCK_SIZE//no_cells)
+
+    dP_ij = np.zeros((no_cells,no_cells),dtype)
+    for ini in range(0,no_cells,block_rows):
+        end = min(ini+block_rows,no_cells)
+        cos_ij = np.asarray(parameters[1,ini:end,:],dtype=np.float64)
+        cos_ji = np.asarray(parameters[1,:,ini:end],dtype=np.float64).T
+        dis2 = np.power(np.asarray(parameters[0,ini:end,:],dtype=np.float64),2)
+        np.divide(rho*delta_A*cos_ij*cos_ji,np.pi*dis2,out=dP_ij[ini:end],where=dis2!=0)
+
+    #dP_ij_1d = dP_ij.flatten()
+    #numpy.savetxt("dPij.csv", dP_ij[:,0], delimiter=",")
+
+    return dP_ij
+
+
+def device_normal(
+    position: List[float],
+    index: "CellIndex"
+    ) -> List[float]:
+    """Function to get the normal vector of the wall where a device is placed.
+    
+    The device must be on a wall plane (within WALL_TOLERANCE), the normal of 
+    a device inside of the room is not defined by the walls and it must be 
+    given explicitly.
+    """
+
+    position = np.asarray(position,dtype=np.float64)
+    label = int(index.nearest_wall(position))
+    distance = np.abs(position[np.argmax(np.abs(NORMAL_VECTOR_WALL[label]))] - index.planes[label])
+
+    if distance > WALL_TOLERANCE:
+        raise ValueError("The device at "+str(position.tolist())+" is not on a wall, its normal vector must be given.")
+
+    return np.array(NORMAL_VECTOR_WALL[label],dtype=np.float64)
+
+
+def source_terms(
+    m: float,
+    tx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    rho: float,
+    delta_A: float,
+    tx_normal: List[float] = None,
+    dtype: type = np.float32
+    ) -> Tuple[Transmitters,List[float],List[float]]:
+    """Function to compute the link terms of the source, shared by every receiver.
+    
+    The source can be at any position, its terms are computed from the 
+    geometry with transmitter_terms.
+
+    Parameters:
+        m: lambertian number to tx emission
+        tx_pos: 1d-array with [x,y,z] tx position
+        points: List with [x,y,z] cooridinates for every point in each wall
+        wall_label: 1d-array with the wall label of each point
+        parameters: List with angle and distance between all points, if it 
+            is None dP_ij is not computed and it is None
+        x_lim,y_lim,z_lim: limits in room dimmensions
+        rho: reflectance of the walls
+        delta_A: cell area in the model
+        tx_normal: normal vector of the source, by default the normal of the 
+            wall where it is placed, it is required if the source is not on a 
+            wall
+        dtype: data type of h0_se and dP_ij
+
+    Returns: A list with the next parameters
+        transmitter: Transmitters array with the source
+        h0_se: 2d-array with [power_ray,time_delay] between source and each cell
+        dP_ij: 2d-array with power transfer factor between cells
+
+    """
+
+    if tx_normal is None:
+        tx_normal = device_normal(tx_pos,CellIndex(points,wall_label))
+
+    transmitter = make_transmitters(tx_pos,tx_normal,m,1.0)
+    se_power,se_delay = transmitter_terms(transmitter,points,wall_label,x_lim,y_lim,z_lim,rho,delta_A,dtype)
+
+    #Impulse response and time delay between source and each cells 
+    h0_se = np.stack([se_power[:,0],se_delay[:,0]],axis=1).astype(dtype)
+
+    dP_ij = None if parameters is None else transfer_matrix(parameters,rho,delta_A,dtype)
+
+    return transmitter,h0_se,dP_ij
+
+
+def compute_link_terms(
+    m: float,
+    tx_pos: List[float],
+    rx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    a_r: float,
+    rho: float,
+    delta_A: float,
+    tx_normal: List[float] = None,
+    rx_normal: List[float] = None,
+    fov: float = np.pi/2,
+    concentrator: float = None,
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float],List[float],List[float]]:
+    """Function to compute the link terms shared by every reflection order.
+    
+    The source and the receiver are devices at any position, they do not need 
+    to be on a cell. Their terms are computed from the geometry in bulk. Cells 
+    behind the source have zero power in h0_se, and cells behind the receiver 
+    or outside of its field of view have zero power in h0_er.
+
+    Parameters:
+        m: lambertian number to tx emission
+        tx_pos: 1d-array with [x,y,z] tx position
+        rx_pos: 1d-array with [x,y,z] rx position
+        points: List with [x,y,z] cooridinates for every point in each wall
+        wall_label: 1d-array with the wall label of each point
+        parameters: List with angle and distance between all points, if it 
+            is None only the device terms are computed and dP_ij is None
+        x_lim,y_lim,z_lim: limits in room dimmensions
+        a_r: sensitive area in photodetector
+        rho: reflectance of the walls
+        delta_A: cell area in the model
+        tx_normal,rx_normal: normal vectors of the devices, by default the 
+            normal of the wall where they are placed, they are required if the 
+            devices are not on a wall
+        fov: half-angle field of view [rad] of the receiver
+        concentrator: refractive index of the concentrator of the receiver, 
+            None if there is no concentrator
+        dtype: data type of the link terms
+
+    Returns: A list with the next parameters
+        h_los: 1d-array with [power_ray,time_delay] of the line of sight
+        h0_se: 2d-array with [power_ray,time_delay] between source and each cell
+        h0_er: 2d-array with [power_ray,time_delay] between each cell and receiver
+        dP_ij: 2d-array with power transfer factor between cells
+
+    """
+
+    dtype = propagation_dtype(dtype)
+
+    if tx_normal is None or rx_normal is None:
+        index = CellIndex(points,wall_label)
+        tx_normal = device_normal(tx_pos,index) if tx_normal is None else tx_normal
+        rx_normal = device_normal(rx_pos,index) if rx_normal is None else rx_normal
+
+    transmitter,h0_se,dP_ij = source_terms(m,tx_pos,points,wall_label,parameters,x_lim,y_lim,z_lim,rho,delta_A,tx_normal,dtype)
+    receiver = make_receivers(rx_pos,rx_normal,a_r,fov,concentrator)
+    er_power,er_delay = receiver_terms(receiver,points,wall_label,dtype)
+
+    #Impulse response and time delay between receiver and each cells 
+    h0_er = np.stack([er_power[:,0],er_delay[:,0]],axis=1).astype(dtype)
+
+    #Impulse response and time delay of the line of sight
+    los_power,los_delay = los_terms(transmitter,receiver)
+    h_los = np.array([los_power[0,0],los_delay[0,0]],dtype=dtype)
+
+    return h_los,h0_se,h0_er,dP_ij
+
+
+def reflection_powers(
+    h0_se: List[float],
+    h0_er: List[float],
+    dP_ij: List[float],
+    k_reflec: int,
+    tol: float = None,
+    los_power: float = 0.0
+    ) -> List[float]:
+    """Function to compute the total power of each reflection without rays.
+    
+    The power of the reflection k is h0_se*dP_ij**(k-1)*h0_er, it is computed 
+    with k-1 matrix-vector products.
+
+    Parameters:
+        h0_se: 2d-array with [power_ray,time_delay] between source and each cell
+        h0_er: 2d-array with [power_ray,time_delay] between each cell and receiver
+        dP_ij: 2d-array with power transfer factor between cells
+        k_reflec: maximum number of reflections
+        tol: if it is given, stops when the power of the last reflection is lower 
+            than tol times the accumulated power (including los_power)
+        los_power: power of the line of sight
+
+    Returns: A list with the power of the reflections [1,2,...].
+
+    """
+
+    powers = []
+    source = h0_se[:,0].astype(np.float64)
+
+    for i in range(1,k_reflec+1):
+        if i > 1:
+            source = dP_ij.T @ source
+        
+        powers.append(float(np.dot(source,h0_er[:,0])))
+        
+        if tol is not None and powers[-1] <= tol*(los_power + sum(powers)):
+            break
+
+    return powers
+
+
+def dc_gain(
+    m: float,
+    tx_pos: List[float],
+    rx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    a_r: float,
+    rho: float,
+    delta_A: float,
+    tol: float = REFLECTION_TOLERANCE,
+    max_iter: int = MAX_REFLECTIONS,
+    method: str = "cg",
+    implicit: bool = False,
+    stats: dict = None,
+    tx_normal: List[float] = None,
+    rx_normal: List[float] = None,
+    fov: float = np.pi/2,
+    concentrator: float = None
+    ) -> float:
+    """Function to compute the DC gain of the channel with infinite reflections.
+
+    The power that arrives to each cell after any number of reflections is 
+    the solution x of (I - dP_ij)*x = h0_se, and the reflected power in the 
+    receiver is x*h0_er. The system is solved iteratively without rays:
+        'cg': conjugate gradient, dP_ij is symmetric and its spectral radius 
+            is lower than rho, so I - dP_ij is symmetric positive definite
+        'jacobi': fixed-point iteration x = h0_se + dP_ij*x, the iteration n 
+            is the sum of the first n reflections of reflection_powers
+    The link terms, dP_ij and the iterations are computed in float64, with no 
+    precision policy.
+
+    Parameters:
+        m,tx_pos,...,delta_A: same parameters of compute_link_terms
+        tol: relative residual |h0_se - (I - dP_ij)*x|/|h0_se| to stop
+        max_iter: maximum number of iterations
+        method: iterative method, 'cg' or 'jacobi'
+        implicit: if it is True dP_ij is applied with a ToeplitzOperator, the 
+            dense dP_ij is not built and parameters can be None
+        stats: optional dict filled with the los_power, reflected_power, the 
+            iterations and the relative residual
+        tx_normal,rx_normal,fov,concentrator: same parameters of compute_link_terms
+
+    Returns: The DC gain, line of sight plus all the reflections.
+
+    """
+
+    h_los,h0_se,h0_er,dP_ij = compute_link_terms(m,tx_pos,rx_pos,points,wall_label,None if implicit else parameters,
+        x_lim,y_lim,z_lim,a_r,rho,delta_A,tx_normal=tx_normal,rx_normal=rx_normal,fov=fov,concentrator=concentrator,dtype=np.float64)
+
+    if implicit:
+        dP_ij = ToeplitzOperator(points,wall_label,rho,delta_A)
+
+    b = h0_se[:,0].astype(np.float64)
+    norm_b = np.linalg.norm(b)
+    x = np.zeros_like(b)
+    residual = b.copy()
+    iteration = 0
+
+    if method == "cg":
+        direction = residual.copy()
+        residual_2 = np.dot(residual,residual)
+        while iteration < max_iter and np.sqrt(residual_2) > tol*norm_b:
+            a_direction = direction - dP_ij @ direction
+            alpha = residual_2/np.dot(direction,a_direction)
+            x += alpha*direction
+            residual -= alpha*a_direction
+            residual_2,last_residual_2 = np.dot(residual,residual),residual_2
+            direction = residual + (residual_2/last_residual_2)*direction
+            iteration += 1
+    elif method == "jacobi":
+        while iteration < max_iter and np.linalg.norm(residual) > tol*norm_b:
+            x += residual
+            residual = b - x + dP_ij @ x
+            iteration += 1
+    else:
+        raise ValueError("Unknown method: "+str(method))
+
+    reflected_power = float(np.dot(x,h0_er[:,0]))
+
+    if stats is not None:
+        stats.update({"los_power":float(h_los[0]),"reflected_power":reflected_power,"iterations":iteration,
+            "residual":float(np.linalg.norm(b - x + dP_ij @ x)/norm_b) if norm_b > 0 else 0.0})
+
+    return float(h_los[0]) + reflected_power
+
+
+def histogram_rays(
+    power: List[float],
+    delay: List[float],
+    delay_los: float,
+    overflow: str = HIST_OVERFLOW
+    ) -> Tuple[List[float],float]:
+    """Function to accumulate the power of rays in bins of TIME_RESOLUTION.
+    
+    The bin of each ray is floor((delay-delay_los)/TIME_RESOLUTION), rays before 
+    the line of sight go to the first bin. The input arrays are not modified.
+
+    Parameters:
+        power: 1d-array with the power of each ray
+        delay: 1d-array with the time delay of each ray
+        delay_los: time delay of the line of sight
+        overflow: policy for rays delayed beyond BINS_HIST bins, 'drop' discards 
+            them, 'clip' adds them to the last bin and 'raise' raises IndexError
+
+    Returns:
+        hist_power: 1d-array with the power of each bin
+        out_power: power of the rays beyond the histogram
+
+    """
+
+    hist_power = get_kernels()["bin_rays"](power,delay,delay_los,TIME_RESOLUTION,BINS_HIST)
+    out_power = hist_power[BINS_HIST]
+    
+    if overflow == "clip":
+        hist_power[BINS_HIST-1] += out_power
+    elif overflow == "raise" and np.any(np.floor((delay - delay_los)/TIME_RESOLUTION) >= BINS_HIST):
+        raise IndexError("Rays delayed beyond "+str(BINS_HIST)+" bins of the histogram.")
+    elif overflow not in ["drop","clip","raise"]:
+        raise ValueError("Unknown overflow policy: "+str(overflow))
+
+    return hist_power[:BINS_HIST],out_power
+
+
+class HistogramAccumulator:
+    """Streaming accumulator of the power histograms for each reflection.
+    
+    Chunks of rays (power, time delay) of any reflection are added in any 
+    order and binned without modifying the input arrays, so the full ray list 
+    is never needed. The delay of the line of sight is the reference of the 
+    bins, it is taken from the first chunk of the reflection 0 if it is not 
+    given. Each chunk is binned in float64 and added to histograms of dtype, 
+    float16 is promoted to float32 (see propagation_dtype) because the powers 
+    of the reflections are below its normal range.
+    finalize returns the same histograms of create_histograms.
+
+    """
+
+    def __init__(
+        self,
+        k_reflec: int = 0,
+        delay_los: float = None,
+        overflow: str = HIST_OVERFLOW,
+        dtype: type = np.float64
+        ) -> None:
+
+        self.delay_los = delay_los
+        self.overflow = overflow
+        self.dtype = np.dtype(propagation_dtype(dtype))
+        self.hist_power = [np.zeros((BINS_HIST),dtype=self.dtype) for i in range(k_reflec+1)]
+        self.power = [0.0]*(k_reflec+1)
+        self.out_power = [0.0]*(k_reflec+1)
+        self.discarded_power = [0.0]*(k_reflec+1)
+        self.no_rays = [0]*(k_reflec+1)
+
+
+    @property
+    def k_reflec(self) -> int:
+        return len(self.hist_power) - 1
+
+
+    def grow(self,order: int) -> None:
+        """Method to add empty histograms up to the reflection order."""
+
+        while order > self.k_reflec:
+            self.hist_power.append(np.zeros((BINS_HIST),dtype=self.dtype))
+            self.power.append(0.0)
+            self.out_power.append(0.0)
+            self.discarded_power.append(0.0)
+            self.no_rays.append(0)
+
+
+    def add_discarded(
+        self,
+        order: int,
+        power: float
+        ) -> None:
+        """Method to record power of the reflection order discarded before binning (pruned rays)."""
+
+        self.grow(order)
+        self.discarded_power[order] += power
+
+
+    def add(
+        self,
+        order: int,
+        power: List[float],
+        delay: List[float]
+        ) -> None:
+        """Method to bin a chunk of rays of the reflection order."""
+
+        if self.delay_los is None:
+            if order != 0 or len(delay) == 0:
+                raise ValueError("The line of sight (reflection 0) must be added before other reflections.")
+            self.delay_los = delay[0]
+
+        self.grow(order)
+        hist_power,out_power = histogram_rays(power,delay,self.delay_los,self.overflow)
+        
+        self.hist_power[order] += hist_power
+        self.power[order] += np.sum(power)
+        self.out_power[order] += out_power
+        self.no_rays[order] += len(power)
+
+
+    def finalize(
+        self,
+        report: bool = True
+        ) -> Tuple[List[float],List[float],List[float]]:
+        """Method to create the histograms of create_histograms.
+
+        Returns: A List with the next parameters
+            hist_power_time: Power histograms for each reflection
+            total_ht: total power CIR histrogram 
+            time_scale: 1d-array with time scale
+
+        """
+
+        if report:
+            print("//------------- Data report ------------------//")
+            print("Time resolution [s]:"+str(TIME_RESOLUTION))
+            print("Number of Bins:"+str(BINS_HIST))
+            
+            for i in range(self.k_reflec+1):
+                print("h"+str(i)+"-Response:")                       
+                print("Power[w]:",self.power[i])
+                if i==0:
+                    print("Delay[s]:",self.delay_los)
+                if self.out_power[i] != 0:
+                    print("Power out of histogram[W]:",self.out_power[i])
+                if self.discarded_power[i] != 0:
+                    print("Discarded power[W]:",self.discarded_power[i])
+
+            print("Total-Response:")
+            print("Total-Power[W]:"+str(sum(self.power)))  
+            if sum(self.discarded_power) != 0:
+                print("Total-Discarded-Power[W]:"+str(sum(self.discarded_power)))
+
+        hist_power_time = np.stack(self.hist_power,axis=1)
+        total_ht = np.sum(hist_power_time,axis=1)
+        time_scale = linspace(0,BINS_HIST*TIME_RESOLUTION,num=BINS_HIST)        
+
+        return hist_power_time,total_ht,time_scale
+
+
+def compute_cir(
+    m: float,
+    tx_pos: List[float],
+    rx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    no_xtick: float,
+    no_ytick: float,
+    no_ztick: float,
+    init_index: float,
+    a_r: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: float,
+    accumulator: HistogramAccumulator = None,
+    prune_power: float = 0.0,
+    prune_ratio: float = 0.0,
+    tol: float = REFLECTION_TOLERANCE,
+    time_budget: float = None,
+    memory_budget: float = None,
+    tx_normal: List[float] = None,
+    rx_normal: List[float] = None,
+    fov: float = np.pi/2,
+    concentrator: float = None,
+    dtype: type = np.float32,
+    output_format: str = OUTPUT_FORMAT,
+    writer: "ResultWriter" = None,
+    stats: dict = None
+    ) -> List[float]:    
+    """ Function to compute the channel impulse response for each reflection. 
+    
+    Parameters:
+        m: lambertian number to tx emission
+        tx_pos: 1d-array with [x,y,z] tx position
+        rx_pos: 1d-array with [x,y,z] rx position
+        points: List with [x,y,z] cooridinates for every point in each wall
+        parameters: List with angle and distance between all points.  
+        x_lim,y_lim,z_lim: limits in room dimmensions
+        a_r: sensitive area in photodetector
+        no_xtick,no_ytick,no_ztick: number of division in each axes.
+        accumulator: optional HistogramAccumulator, if it is given the rays 
+            are streamed to it by chunks from iter_cir instead of returned
+        prune_power,prune_ratio: power thresholds of the partial paths to the 
+            receiver (hlast_er), the paths below them are not extended to the 
+            next bounce. prune_power is absolute [W] and prune_ratio is 
+            relative to the total power from the cells to the receiver (sum 
+            of h0_er). The same paths are pruned with an accumulator (iter_cir)
+        k_reflec: number of reflections, or "auto" to add reflections until 
+            the power of the last one is lower than tol times the accumulated 
+            power, or the time_budget [s] or the memory_budget [bytes] of the 
+            next reflection is exceeded. The budgets only apply to the ray 
+            list, memory_budget is CIR_MEMORY_BUDGET if it is None
+        tx_normal,rx_normal,fov,concentrator: normal vectors of the devices,
+            field of view and concentrator of the receiver, see compute_link_terms
+        dtype: data type of the link terms, the propagation and the rays, see 
+            propagation_dtype
+        output_format: format of the files of h0 and h1 in CIR_PATH, see 
+            save_result, None does not write them. They are also written 
+            when the rays are streamed to an accumulator
+        writer: optional ResultWriter that writes the files in background
+        stats: optional dict filled with the pruning report: threshold, 
+            pruned_paths and discarded_power (list with the power per reflection)
+
+    Only the cells in front of the source start rays and only the cells in the 
+    field of view of the receiver end them, the other cells are culled.
+
+    Returns: A list with 2d-array [power_ray,time_delay] collection for each 
+    refletion [h_0,h_1,...,h_k], or the accumulator if it is given. If k_reflec 
+    is "auto", a tuple with that result and a dict with the reached k_reflec, 
+    the estimated residual_power of the next reflections and the stop_reason.
+
+
+    """
+
+    dtype = propagation_dtype(dtype)
+    
+    #compute the total number of points (cells)
+    no_cells = len(points[0,:])
+
+    auto = k_reflec == "auto"
+
+    if stats is None:
+        stats = {}
+
+    if accumulator is not None:
+        if time_budget is not None or memory_budget is not None:
+            raise ValueError("time_budget and memory_budget only apply to the ray list, without accumulator.")
+        
+        output = save_result if writer is None else writer.save_result
+
+        for order,power,delay in iter_cir(m,tx_pos,rx_pos,points,wall_label,parameters,x_lim,y_lim,z_lim,
+            no_xtick,no_ytick,no_ztick,init_index,a_r,rho,delta_A,k_reflec,
+            prune_power=prune_power,prune_ratio=prune_ratio,stats=stats,tol=tol,tx_normal=tx_normal,rx_normal=rx_normal,fov=fov,concentrator=concentrator,
+            dtype=dtype):
+            accumulator.add(order,power,delay)
+            #the line of sight and the first reflection are streamed in one chunk each
+            if order <= 1 and output_format is not None:
+                output("h"+str(order),{"power":power,"delay":delay},CIR_PATH,output_format)
+        
+        for order,power in enumerate(stats["discarded_power"]):
+            accumulator.add_discarded(order,power)
+        
+        if auto:
+            return accumulator,{key:stats[key] for key in ["k_reflec","residual_power","stop_reason"]}
+
+        return accumulator
+
+    h_los,h0_se,h0_er,dP_ij = compute_link_terms(m,tx_pos,rx_pos,points,wall_label,parameters,x_lim,y_lim,z_lim,a_r,rho,delta_A,
+        tx_normal=tx_normal,rx_normal=rx_normal,fov=fov,concentrator=concentrator,dtype=dtype)
+
+    #only the cells reached by the source start paths and only the cells in the field of view of the receiver end them
+    tx_cells = np.nonzero(h0_se[:,0] > 0)[0]
+    rx_cells = np.nonzero(h0_er[:,0] > 0)[0]
+
+    h_k = []
+    hlast_er = []
+    output = save_result if writer is None else writer.save_result
+    
+    max_reflec = MAX_REFLECTIONS if auto else k_reflec
+    stop_reason = "max_reflections"
+    starttime = timeit.default_timer()
+    memory_budget = CIR_MEMORY_BUDGET if memory_budget is None else memory_budget
+    itemsize = np.dtype(dtype).itemsize
+
+    threshold = max(prune_power,prune_ratio*float(np.sum(h0_er[:,0],dtype=np.float64)))
+    stats.update({"threshold":threshold,"pruned_paths":0,"discarded_power":[0.0]*(max_reflec+1)})
+
+    if threshold > 0:
+        #power that arrives to each cell from the source after r bounces
+        se_bounces = [h0_se[:,0].astype(np.float64)]
+        for r in range(1,max_reflec):
+            se_bounces.append(dP_ij.T @ se_bounces[-1])
+
+    for i in range(max_reflec+1):
+        
+        if auto and i > 1:
+            if time_budget is not None and timeit.default_timer() - starttime > time_budget:
+                stop_reason = "time"
+                break
+            #h_k and hlast_er (power, delay and int64 cell) of the next reflection and the previous h_k
+            no_paths = len(hlast_er[i-1][0])
+            if no_paths*(2*itemsize*(len(tx_cells) + no_cells) + 8*no_cells) + sum(h.nbytes for h in h_k) > memory_budget:
+                stop_reason = "memory"
+                break
+
+        if i == 0:           
+
+            h_k.append(np.zeros((1,2),dtype))
+            hlast_er.append(None)
+            h_k[i][0,:] = h_los
+
+            print("//------------- h0-computed ------------------//")            
+            if output_format is not None:
+                output("h0",{"power":h_k[i][:,0],"delay":h_k[i][:,1]},CIR_PATH,output_format)
+
+        elif i==1:
+            #partial paths from each cell to the receiver, with the index of the cell
+            hlast_er.append((h0_er[rx_cells,0],h0_er[rx_cells,1],rx_cells))
+            if max_reflec > 1:
+                delay_ij = (parameters[0,:,:].astype(np.float64)/SPEED_OF_LIGHT).astype(dtype)
+
+            cells = np.intersect1d(tx_cells,rx_cells)
+            h_k.append(np.zeros((len(cells),2),dtype))
+            h_k[i][:,0] = np.multiply(h0_se[cells,0],h0_er[cells,0]) 
+            h_k[i][:,1] = h0_se[cells,1] + h0_er[cells,1]
+
+            print("//------------- h1-computed ------------------//")
+            if output_format is not None:
+                output("h1",{"power":h_k[i][:,0],"delay":h_k[i][:,1]},CIR_PATH,output_format)
+            
+
+        else:
+            last_power,last_delay,last_cells = hlast_er[i-1]
+
+            if threshold > 0:
+                #the pruned paths would deliver p*se_bounces[r] to the reflection i-1+r
+                pruned = last_power < threshold
+                stats["pruned_paths"] += int(np.count_nonzero(pruned))
+                for r in range(1,max_reflec-i+2):
+                    stats["discarded_power"][i-1+r] += float(np.dot(last_power[pruned],se_bounces[r][last_cells[pruned]]))
+                
+                last_power,last_delay,last_cells = last_power[~pruned],last_delay[~pruned],last_cells[~pruned]
+
+            #every partial path is extended to every cell, the new first cell changes faster
+            next_power,next_delay = expand_paths(last_power,last_delay,last_cells,dP_ij,delay_ij)
+
+            #the rays of each source cell are the partial paths that start in that cell
+            h_k.append(np.zeros((len(tx_cells),len(last_cells),2),dtype))
+            h_k[i][:,:,0] = np.multiply(next_power[:,tx_cells].T,h0_se[tx_cells,0,np.newaxis])
+            h_k[i][:,:,1] = h0_se[tx_cells,1,np.newaxis] + next_delay[:,tx_cells].T
+            h_k[i] = h_k[i].reshape((-1,2))
+
+            hlast_er.append((next_power.ravel(),next_delay.ravel(),np.tile(np.arange(no_cells),len(last_cells))))
+
+            print("//------------- h"+str(i)+"-computed ------------------//")      
+            
+            #only the last partial paths are needed for the next reflection
+            hlast_er[i-1] = None
+
+        if auto and i > 0:
+            order_power = [float(np.sum(h[:,0])) for h in h_k]
+            if order_power[-1] <= tol*sum(order_power):
+                stop_reason = "tolerance"
+                break
+
+    del stats["discarded_power"][len(h_k):]
+
+    if auto:
+        k_reached = len(h_k) - 1
+        #power of the next reflections from the series of matrix-vector products
+        powers = reflection_powers(h0_se,h0_er,dP_ij,MAX_REFLECTIONS,tol=tol*1e-3,los_power=float(h_los[0]))
+        info = {"k_reflec":k_reached,"residual_power":float(sum(powers[k_reached:])),"stop_reason":stop_reason}
+        print("Reflections:",k_reached,"Residual power[W]:",info["residual_power"],"Stop:",stop_reason)
+        
+        return h_k,info
+                 
+    return h_k
+
+
+def iter_cir(
+    m: float,
+    tx_pos: List[float],
+    rx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    no_xtick: float,
+    no_ytick: float,
+    no_ztick: float,
+    init_index: float,
+    a_r: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: float,
+    chunk_size: int = CIR_CHUNK_SIZE,
+    prune_power: float = 0.0,
+    prune_ratio: float = 0.0,
+    stats: dict = None,
+    tol: float = REFLECTION_TOLERANCE,
+    tx_normal: List[float] = None,
+    rx_normal: List[float] = None,
+    fov: float = np.pi/2,
+    concentrator: float = None,
+    dtype: type = np.float32
+    ):
+    """ Generator of the channel impulse response rays by chunks of bounded size. 
+    
+    The tree of bounces is walked depth-first from the receiver, as the partial 
+    paths to the receiver (hlast_er) of compute_cir: a tile of partial paths is 
+    extended to a new first cell and its children are walked before the next 
+    tile. Only one tile per reflection is kept in memory, so the peak memory is 
+    about k_reflec*chunk_size rays for any reflection order. The rays are the 
+    same of compute_cir, in a different order.
+
+    Partial paths with power lower than a threshold are pruned before they are 
+    extended, with the same rule of compute_cir, so both prune the same paths. 
+    The power that the pruned paths would deliver to the receiver in each 
+    reflection is computed exactly with the vectors (dP_ij.T)**r*h0_se, and 
+    it is reported in stats.
+
+    Parameters:
+        m,tx_pos,...,k_reflec: same parameters of compute_cir
+        chunk_size: maximum number of rays of each chunk, it is at least no_cells
+        prune_power,prune_ratio: same parameters of compute_cir
+        stats: optional dict filled with the pruning report: threshold, 
+            pruned_paths and discarded_power (list with the power per reflection)
+        tol: relative tolerance if k_reflec is "auto", the number of reflections 
+            is chosen from the series of reflection_powers and it is reported in 
+            stats with the residual_power of the next reflections
+        tx_normal,rx_normal,fov,concentrator,dtype: same parameters of compute_cir
+
+    Yields: A tuple (order,power_chunk,time_delay_chunk) with 1d-arrays.
+
+    """
+
+    dtype = propagation_dtype(dtype)
+
+    no_cells = len(points[0,:])
+    chunk_size = max(chunk_size,no_cells)
+
+    h_los,h0_se,h0_er,dP_ij = compute_link_terms(m,tx_pos,rx_pos,points,wall_label,parameters,x_lim,y_lim,z_lim,a_r,rho,delta_A,
+        tx_normal=tx_normal,rx_normal=rx_normal,fov=fov,concentrator=concentrator,dtype=dtype)
+
+    if stats is None:
+        stats = {}
+
+    if k_reflec == "auto":
+        powers = reflection_powers(h0_se,h0_er,dP_ij,MAX_REFLECTIONS,tol=tol*1e-3,los_power=float(h_los[0]))
+        cumulative = float(h_los[0]) + np.cumsum(powers)
+        converged = np.nonzero(np.array(powers) <= tol*cumulative)[0]
+        k_reflec = int(converged[0]) + 1 if len(converged) else len(powers)
+        stats.update({"k_reflec":k_reflec,"residual_power":float(sum(powers[k_reflec:])),
+            "stop_reason":"tolerance" if len(converged) else "max_reflections"})
+
+    yield 0,h_los[0:1],h_los[1:2]
+
+    threshold = max(prune_power,prune_ratio*float(np.sum(h0_er[:,0],dtype=np.float64)))
+    
+    stats.update({"threshold":threshold,"pruned_paths":0,"discarded_power":[0.0]*(k_reflec+1)})
+
+    if threshold > 0:
+        #power that arrives to each cell from the source after r bounces
+        se_bounces = [h0_se[:,0].astype(np.float64)]
+        for r in range(1,k_reflec):
+            se_bounces.append(dP_ij.T @ se_bounces[-1])
+
+    tx_active = h0_se[:,0] > 0
+    if k_reflec > 1:
+        delay_ij = (parameters[0,:,:].astype(np.float64)/SPEED_OF_LIGHT).astype(dtype)
+
+    def walk(power,delay,cells,order):
+        #rays starting in the source before the first cell of the partial paths, cells behind the source are culled
+        reach = tx_active[cells]
+        yield order,h0_se[cells[reach],0]*power[reach],h0_se[cells[reach],1] + delay[reach]
+
+        if order == k_reflec:
+            return
+        
+        if threshold > 0:
+            #the pruned paths would deliver p*se_bounces[r] to the reflection order+r
+            pruned = power < threshold
+            stats["pruned_paths"] += int(np.count_nonzero(pruned))
+            for r in range(1,k_reflec-order+1):
+                stats["discarded_power"][order+r] += float(np.dot(power[pruned],se_bounces[r][cells[pruned]]))
+            
+            power,delay,cells = power[~pruned],delay[~pruned],cells[~pruned]
+
+        tile = max(1,chunk_size//no_cells)
+        for ini in range(0,len(power),tile):
+            last_cells = cells[ini:ini+tile]
+            next_power,next_delay = expand_paths(power[ini:ini+tile],delay[ini:ini+tile],last_cells,dP_ij,delay_ij)
+
+            yield from walk(next_power.ravel(),next_delay.ravel(),np.tile(np.arange(no_cells),len(last_cells)),order+1)
+
+    if k_reflec > 0:
+        #partial paths from each cell to the receiver, cells out of its field of view are culled
+        rx_cells = np.nonzero(h0_er[:,0] > 0)[0]
+        yield from walk(h0_er[rx_cells,0],h0_er[rx_cells,1],rx_cells,1)
+
+
+def propagate_histogram(
+    hist_cells: List[float],
+    moment_cells: List[float],
+    dP_ij: List[float],
+    delay_ij: List[float],
+    fine_resolution: float,
+    delay_origin: float,
+    block_size: int = None
+    ) -> Tuple[List[float],List[float]]:
+    """Function to propagate the power-delay histograms of the cells one reflection.
+    
+    Every non-zero sub-bin of a cell is sent to all cells with the power factor 
+    dP_ij, from its mean delay (moment/power) plus the delay between cells. 
+    The power and the power*delay are accumulated in the sub-bin of the exact 
+    arrival delay, so the delays are not rounded. Power delayed beyond the 
+    last sub-bin is dropped.
+
+    Parameters:
+        hist_cells: 2d-array (cells x bins) with the power-delay histogram of each cell
+        moment_cells: 2d-array (cells x bins) with the power*delay of each sub-bin
+        dP_ij: 2d-array with power transfer factor between cells
+        delay_ij: 2d-array with time delay between cells
+        fine_resolution: time resolution of the histogram bins
+        delay_origin: delay of the start of the first sub-bin
+        block_size: number of (cell,bin) pairs propagated at once
+
+    Returns: 2d-arrays (cells x bins) with the histogram and the moments after one reflection.
+
+    """
+
+    no_cells,no_bins = hist_cells.shape
+    hist_next = np.zeros((no_cells*no_bins))
+    moment_next = np.zeros((no_cells*no_bins))
+    
+    if block_size is None:
+        block_size = max(PROPAGATION_BLOCK_SIZE//no_cells,no_bins)
+
+    cells,bins = np.nonzero(hist_cells)
+    delay_cells = moment_cells[cells,bins]/hist_cells[cells,bins]
+    offset_cells = np.arange(no_cells)*no_bins
+
+    for ini in range(0,len(cells),block_size):
+        cell = cells[ini:ini+block_size]
+        arrival = delay_cells[ini:ini+block_size,np.newaxis] + delay_ij[cell,:].astype(np.float64)
+        shifted = np.floor((arrival - delay_origin)/fine_resolution).astype(np.int64)
+        power = hist_cells[cell,bins[ini:ini+block_size],np.newaxis]*dP_ij[cell,:]
+
+        valid = (shifted < no_bins) & (power != 0)
+        index = (offset_cells + shifted)[valid]
+        hist_next += np.bincount(index,weights=power[valid],minlength=no_cells*no_bins)
+        moment_next += np.bincount(index,weights=(power*arrival)[valid],minlength=no_cells*no_bins)
+
+    return hist_next.reshape((no_cells,no_bins)),moment_next.reshape((no_cells,no_bins))
+
+
+def source_histogram(
+    se_power: List[float],
+    se_delay: List[float],
+    fine_resolution: float,
+    delay_origin: float,
+    no_fine: int
+    ) -> Tuple[List[float],List[float]]:
+    """Function to create the power-delay histograms of the cells lit by the source.
+    
+    Each cell has one sub-bin with the power of the source and its exact delay 
+    in the moment, sources delayed beyond the last sub-bin are dropped.
+
+    Returns: 2d-arrays (cells x no_fine) with the histogram and the moments of the cells.
+
+    """
+
+    no_cells = len(se_power)
+    se_delay = se_delay.astype(np.float64)
+    hist_cells = np.zeros((no_cells,no_fine))
+    moment_cells = np.zeros((no_cells,no_fine))
+
+    tx_bins = np.floor((se_delay - delay_origin)/fine_resolution).astype(np.int64)
+    in_range = (tx_bins < no_fine) & (se_power != 0)
+    hist_cells[np.nonzero(in_range)[0],tx_bins[in_range]] = se_power[in_range]
+    moment_cells[np.nonzero(in_range)[0],tx_bins[in_range]] = se_power[in_range]*se_delay[in_range]
+
+    return hist_cells,moment_cells
+
+
+def fine_origin(
+    delay_los: float,
+    fine_resolution: float
+    ) -> float:
+    """Function to get the start of the first sub-bin, aligned to the line of sight delay and not after t=0."""
+    return delay_los - np.ceil(delay_los/fine_resolution)*fine_resolution
+
+
+def gather_histogram(
+    hist_cells: List[float],
+    moment_cells: List[float],
+    h0_er: List[float],
+    delay_los: float
+    ) -> List[float]:
+    """Function to collect in the receiver the power-delay histograms of the cells.
+    
+    The mean delay of each sub-bin plus the delay to the receiver is binned in 
+    TIME_RESOLUTION bins referred to delay_los, as the rays of create_histograms.
+
+    Parameters:
+        hist_cells: 2d-array (cells x bins) with the power-delay histogram of each cell
+        moment_cells: 2d-array (cells x bins) with the power*delay of each sub-bin
+        h0_er: 2d-array with [power_ray,time_delay] between each cell and receiver
+        delay_los: line of sight delay, start of the first bin
+
+    Returns: 1d-array with the power-delay histogram in the receiver.
+
+    """
+
+    cells,bins = np.nonzero(hist_cells)
+
+    delay = moment_cells[cells,bins]/hist_cells[cells,bins] + h0_er[cells,1].astype(np.float64)
+    power = hist_cells[cells,bins]*h0_er[cells,0]
+
+    return get_kernels()["bin_rays"](power,delay,delay_los,TIME_RESOLUTION,BINS_HIST)[:BINS_HIST]
+
+
+def compute_cir_histograms(
+    m: float,
+    tx_pos: List[float],
+    rx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    no_xtick: float,
+    no_ytick: float,
+    no_ztick: float,
+    init_index: float,
+    a_r: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: float,
+    oversample: int = HIST_OVERSAMPLE,
+    tx_normal: List[float] = None,
+    rx_normal: List[float] = None,
+    fov: float = np.pi/2,
+    concentrator: float = None,
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float],List[float]]:    
+    """ Function to compute the power histograms for each reflection without rays. 
+    
+    Instead of the no_cells**k rays of compute_cir, every cell carries a 
+    power-delay histogram which is propagated to the next reflection through 
+    dP_ij. The memory is O(cells*bins) and the time O(k*cells**2*bins). The 
+    sub-bins of TIME_RESOLUTION/oversample are aligned to the line of sight 
+    delay and each one keeps its power*delay, so the delays are propagated 
+    and binned from the exact mean delay of the paths merged in the sub-bin.
+
+    The power of every reflection is the same of create_histograms up to 
+    round-off, and the histogram of the first reflection has the same bins. 
+    From the second reflection on, paths merged in a sub-bin whose delays 
+    are on both sides of a bin edge are binned together, the error is the 
+    power of the paths closer than about (k-1)*TIME_RESOLUTION/oversample to 
+    an edge. With oversample=8 the relative L1 difference with 
+    create_histograms (bench_cir_engines, 2x2x2 room, 54 and 150 cells) is 
+    about 0.1% for the second reflection and below 7% for the third one, the 
+    worst cases come from many paths of the uniform grid with the same delay 
+    just before an edge.
+
+    Parameters:
+        m,tx_pos,...,k_reflec: same parameters of compute_cir
+        oversample: number of sub-bins per histogram bin 
+        tx_normal,rx_normal,fov,concentrator,dtype: same parameters of compute_cir
+
+    Returns: The same list of create_histograms 
+        hist_power_time: Power histograms for each reflection
+        total_ht: total power CIR histrogram 
+        time_scale: 1d-array with time scale
+
+    The dtype applies to the link terms and dP_ij, the histograms of the 
+    cells are propagated in float64.
+
+    """
+
+    dtype = propagation_dtype(dtype)
+
+    no_cells = len(points[0,:])
+
+    h_los,h0_se,h0_er,dP_ij = compute_link_terms(m,tx_pos,rx_pos,points,wall_label,parameters,x_lim,y_lim,z_lim,a_r,rho,delta_A,
+        tx_normal=tx_normal,rx_normal=rx_normal,fov=fov,concentrator=concentrator,dtype=dtype)
+
+    fine_resolution = TIME_RESOLUTION/oversample
+    delay_los = np.float64(h_los[1])
+    
+    #the sub-bins are aligned to the line of sight delay, the last one ends after the last bin
+    delay_origin = fine_origin(delay_los,fine_resolution)
+    no_fine = int(np.ceil((delay_los - delay_origin)/fine_resolution)) + BINS_HIST*oversample
+    delay_ij = (parameters[0,:,:].astype(np.float64)/SPEED_OF_LIGHT).astype(dtype)
+
+    hist_power_time = np.zeros((BINS_HIST,k_reflec+1))
+    hist_power_time[0,0] = h_los[0]
+    print("//------------- h0-computed ------------------//")
+
+    #only the cells in the field of view of the receiver are collected
+    rx_cells = np.nonzero(h0_er[:,0] > 0)[0]
+    hist_cells,moment_cells = source_histogram(h0_se[:,0],h0_se[:,1],fine_resolution,delay_origin,no_fine)
+
+    for i in range(1,k_reflec+1):
+        if i > 1:
+            hist_cells,moment_cells = propagate_histogram(hist_cells,moment_cells,dP_ij,delay_ij,fine_resolution,delay_origin)
+
+        hist_power_time[:,i] = gather_histogram(hist_cells[rx_cells],moment_cells[rx_cells],h0_er[rx_cells],delay_los)
+        print("//------------- h"+str(i)+"-computed ------------------//")      
+        
+    total_ht = np.sum(hist_power_time,axis=1)
+    time_scale = linspace(0,BINS_HIST*TIME_RESOLUTION,num=BINS_HIST)        
+
+    return hist_power_time,total_ht,time_scale
+
+
+def los_terms(
+    transmitters: Transmitters,
+    receivers: Receivers
+    ) -> Tuple[List[float],List[float]]:
+    """Function to compute the line of sight between every transmitter and every receiver.
+
+    Returns:
+        los_power: 2d-array (Nt x Nr) with the line of sight power of each pair
+        los_delay: 2d-array (Nt x Nr) with the line of sight time delay of each pair
+
+    """
+
+    with np.errstate(invalid="ignore"):
+        distance,cos_tx,cos_rx = pair_parameters(transmitters.position,np.full(transmitters.no_transmitters,-1),
+            transmitters.normal,receivers.position,np.full(receivers.no_receivers,-2),receivers.normal)
+
+    gain = receivers.fov_gain(cos_rx)
+    visible = (cos_tx > 0) & (gain > 0) & (distance != 0)
+    intensity = transmitters.power[:,np.newaxis]*(transmitters.lambert[:,np.newaxis]+1)/(2*np.pi)*np.power(
+        np.clip(cos_tx,0,None),transmitters.lambert[:,np.newaxis])
+    los_power = np.divide(intensity*receivers.area*gain*cos_rx,distance**2,out=np.zeros_like(distance),where=visible)
+
+    return los_power,distance/SPEED_OF_LIGHT
+
+
+def gather_receivers(
+    hist_cells: List[float],
+    moment_cells: List[float],
+    er_power: List[float],
+    er_delay: List[float],
+    delay_los: List[float],
+    block_size: int = None
+    ) -> List[float]:
+    """Function to collect the power-delay histograms of the cells in every receiver.
+
+    The mean delay of each sub-bin plus the delay to each receiver is binned 
+    in TIME_RESOLUTION bins referred to the line of sight delay of the 
+    receiver, power beyond BINS_HIST bins is dropped.
+
+    Parameters:
+        hist_cells: 2d-array (cells x bins) with the power-delay histogram of each cell
+        moment_cells: 2d-array (cells x bins) with the power*delay of each sub-bin
+        er_power: 2d-array (cells x Nr) with the power factor between cells and receivers
+        er_delay: 2d-array (cells x Nr) with the time delay between cells and receivers
+        delay_los: 1d-array with the line of sight time delay of each receiver
+        block_size: number of (cell,bin) pairs collected at once
+
+    Returns: 2d-array (Nr x BINS_HIST) with the histogram of each receiver.
+
+    """
+
+    no_receivers = er_power.shape[1]
+    hist_rx = np.zeros((no_receivers*(BINS_HIST+1)))
+
+    if block_size is None:
+        block_size = max(1,PROPAGATION_BLOCK_SIZE//no_receivers)
+
+    cells,bins = np.nonzero(hist_cells)
+    delay_cells = moment_cells[cells,bins]/hist_cells[cells,bins]
+    offset_rx = np.arange(no_receivers)*(BINS_HIST+1)
+
+    for ini in range(0,len(cells),block_size):
+        cell = cells[ini:ini+block_size]
+        delay = delay_cells[ini:ini+block_size,np.newaxis] + er_delay[cell,:].astype(np.float64)
+        coarse = np.floor((delay - delay_los)/TIME_RESOLUTION)
+        coarse = np.clip(coarse,0,BINS_HIST).astype(np.int64)
+        power = hist_cells[cell,bins[ini:ini+block_size],np.newaxis]*er_power[cell,:]
+
+        valid = power != 0
+        hist_rx += np.bincount((offset_rx + coarse)[valid],weights=power[valid],minlength=no_receivers*(BINS_HIST+1))
+
+    return hist_rx.reshape((no_receivers,BINS_HIST+1))[:,:BINS_HIST]
+
+
+def receivers_histograms(
+    se_power: List[float],
+    se_delay: List[float],
+    dP_ij: List[float],
+    distance: List[float],
+    er_power: List[float],
+    er_delay: List[float],
+    los_power: List[float],
+    delay_los: List[float],
+    k_reflec: int,
+    oversample: int = HIST_OVERSAMPLE
+    ) -> Tuple[List[float],List[float]]:
+    """Function to propagate the histograms of the cells from one source to many receivers.
+
+    Parameters:
+        se_power,se_delay: 1d-arrays with the power and delay between source and each cell
+        dP_ij: 2d-array with power transfer factor between cells
+        distance: 2d-array with distance between cells
+        er_power,er_delay: 2d-arrays (cells x Nr) of receiver_terms
+        los_power,delay_los: 1d-arrays with the line of sight of each receiver
         k_reflec: number of reflections
-        no_cells: number of points of model
+        oversample: number of sub-bins per histogram bin
+
+    Returns:
+        hist_power_time: 3d-array (Nr x BINS_HIST x reflections) with the power histograms
+        power: 2d-array (Nr x reflections) with the total power of each reflection
+
+    """
+
+    no_receivers = er_power.shape[1]
+
+    #the sub-bins are aligned to the first line of sight, the last one ends after the last bin of every receiver
+    fine_resolution = TIME_RESOLUTION/oversample
+    delay_origin = fine_origin(np.min(delay_los),fine_resolution)
+    no_fine = int(np.ceil((np.max(delay_los) - delay_origin)/fine_resolution)) + BINS_HIST*oversample
+    delay_ij = (distance.astype(np.float64)/SPEED_OF_LIGHT).astype(dP_ij.dtype)
+
+    hist_power_time = np.zeros((no_receivers,BINS_HIST,k_reflec+1))
+    hist_power_time[:,0,0] = los_power
+    power = np.zeros((no_receivers,k_reflec+1))
+    power[:,0] = los_power
+    print("//------------- h0-computed ------------------//")
+
+    hist_cells,moment_cells = source_histogram(se_power,se_delay,fine_resolution,delay_origin,no_fine)
+    source = se_power.astype(np.float64)
+
+    for i in range(1,k_reflec+1):
+        if i > 1:
+            hist_cells,moment_cells = propagate_histogram(hist_cells,moment_cells,dP_ij,delay_ij,fine_resolution,delay_origin)
+            source = dP_ij.T @ source
+
+        hist_power_time[:,:,i] = gather_receivers(hist_cells,moment_cells,er_power,er_delay,delay_los)
+        power[:,i] = source @ er_power
+        print("//------------- h"+str(i)+"-computed ------------------//")
+
+    return hist_power_time,power
+
+
+def compute_cir_receivers(
+    m: float,
+    tx_pos: List[float],
+    receivers: Receivers,
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: int,
+    oversample: int = HIST_OVERSAMPLE,
+    tx_normal: List[float] = None,
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float],List[float],List[float]]:
+    """Function to compute the power histograms of many receivers in one propagation.
+
+    The power-delay histograms of the cells (see compute_cir_histograms) only
+    depend on the source, so they are propagated once and collected in every
+    receiver with gather_receivers. The power of each reflection in every
+    receiver is the matrix product of the source vector with the cell to
+    receiver factors. The receivers can be at any position, their normal, area
+    and field of view are taken into account.
+
+    Parameters:
+        m,tx_pos,points,wall_label,parameters,x_lim,...,k_reflec: same parameters of compute_cir
+        receivers: Receivers array
+        oversample: number of sub-bins per histogram bin
+        tx_normal: normal vector of the source, see compute_link_terms
+        dtype: data type of the link terms and dP_ij, see propagation_dtype. 
+            The histograms are accumulated in float64.
+
+    Returns:
+        hist_power_time: 3d-array (Nr x BINS_HIST x reflections) with the power histograms
+        total_ht: 2d-array (Nr x BINS_HIST) with the total power CIR histrogram of each receiver
+        time_scale: 1d-array with time scale
+        power: 2d-array (Nr x reflections) with the total power of each reflection
+
+    """
+
+    dtype = propagation_dtype(dtype)
+
+    transmitter,h0_se,dP_ij = source_terms(m,tx_pos,points,wall_label,parameters,x_lim,y_lim,z_lim,rho,delta_A,tx_normal,dtype)
+    er_power,er_delay = receiver_terms(receivers,points,wall_label,dtype)
+    los_power,delay_los = los_terms(transmitter,receivers)
+
+    hist_power_time,power = receivers_histograms(h0_se[:,0],h0_se[:,1],dP_ij,parameters[0,:,:],
+        er_power,er_delay,los_power[0],delay_los[0],k_reflec,oversample)
+
+    total_ht = np.sum(hist_power_time,axis=2)
+    time_scale = linspace(0,BINS_HIST*TIME_RESOLUTION,num=BINS_HIST)
+
+    return hist_power_time,total_ht,time_scale,power
+
+
+def compute_cir_mimo(
+    transmitters: Transmitters,
+    receivers: Receivers,
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: int,
+    oversample: int = HIST_OVERSAMPLE,
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float],List[float],List[float]]:
+    """Function to compute the power histograms of every transmitter and receiver pair.
+
+    The transfer factor dP_ij and the receiver terms are computed once for all 
+    the pairs. The power of each reflection of every pair is propagated as a 
+    (cells x Nt) matrix, the histograms of the cells are propagated for each 
+    transmitter as in compute_cir_receivers.
+
+    Parameters:
+        transmitters: Transmitters array
+        receivers: Receivers array
+        points,wall_label,parameters,x_lim,...,k_reflec: same parameters of compute_cir
+        oversample: number of sub-bins per histogram bin
+        dtype: same parameter of compute_cir_receivers
 
-    Returns: A List with the next parameters
-        hist_power_time: Power histograms for each reflection
-        total_ht: total power CIR histrogram 
+    Returns:
+        hist_power_time: 4d-array (Nt x Nr x BINS_HIST x reflections) with the power histograms
+        total_ht: 3d-array (Nt x Nr x BINS_HIST) with the total power CIR histrogram of each pair
         time_scale: 1d-array with time scale
+        power: 3d-array (Nt x Nr x reflections) with the channel matrix of each reflection
 
     """
-        
-    print("//------------- Data report ------------------//")
-    print("Time resolution [s]:"+str(TIME_RESOLUTION))
-    print("Number of Bins:"+str(BINS_HIST))
-    h_power = np.zeros((k_reflec+1))
-
-    hk_aux = []
-    
-    delay_los = h_k[0][0,1]
-    hist_power_time = np.zeros((BINS_HIST,k_reflec+1))
-    
 
+    dtype = propagation_dtype(dtype)
 
-    for i in range(k_reflec+1):            
-        
-        hk_aux.append(np.zeros((int(no_cells**i),2)))
+    dP_ij = transfer_matrix(parameters,rho,delta_A,dtype)
+    se_power,se_delay = transmitter_terms(transmitters,points,wall_label,x_lim,y_lim,z_lim,rho,delta_A,dtype)
+    er_power,er_delay = receiver_terms(receivers,points,wall_label,dtype)
+    los_power,delay_los = los_terms(transmitters,receivers)
 
-        # Compute and print the total power per order reflection
-        print("h"+str(i)+"-Response:")                       
-        h_power[i] = np.sum(h_k[i][:,0])
-        print("Power[w]:",h_power[i])
-        if i==0:
-            print("Delay[s]:",h_k[i][0,1])
+    hist_power_time = np.zeros((transmitters.no_transmitters,receivers.no_receivers,BINS_HIST,k_reflec+1))
+    for t in range(transmitters.no_transmitters):
+        hist_power_time[t] = receivers_histograms(se_power[:,t],se_delay[:,t],dP_ij,parameters[0,:,:],
+            er_power,er_delay,los_power[t],delay_los[t],k_reflec,oversample)[0]
 
-        # Create graphs 
-               
-        hk_aux[i] = h_k[i]
-        hk_aux[i][:,1] = hk_aux[i][:,1] - delay_los
-        hk_aux[i][:,1] = np.floor(hk_aux[i][:,1]/TIME_RESOLUTION)
+    power = np.zeros((transmitters.no_transmitters,receivers.no_receivers,k_reflec+1))
+    power[:,:,0] = los_power
+    source = se_power.astype(np.float64)
+    for i in range(1,k_reflec+1):
+        if i > 1:
+            source = dP_ij.T @ source
+        power[:,:,i] = source.T @ er_power
 
-        for j in range(no_cells**i):
-           hist_power_time[int(hk_aux[i][j,1]),i] += hk_aux[i][j,0]
+    total_ht = np.sum(hist_power_time,axis=3)
+    time_scale = linspace(0,BINS_HIST*TIME_RESOLUTION,num=BINS_HIST)
 
-                
-        time_scale = linspace(0,BINS_HIST*TIME_RESOLUTION,num=BINS_HIST)        
+    return hist_power_time,total_ht,time_scale,power
 
+#
+def create_histograms(
+    h_k: List[float],
+    k_reflec: int,
+    no_cells: int,
+    overflow: str = HIST_OVERFLOW,
+    dtype: type = np.float64
+    ) -> Tuple[List[float],List[float],List[float]]:
+    """Function to create histograms from channel impulse response raw data. 
     
-    print("Total-Response:")
-    print("Total-Power[W]:"+str(sum(h_power)))  
-    
-    total_ht = np.sum(hist_power_time,axis=1)
+    The channel impulse response raw data is a list with power and time delay 
+    of each ray. The histogram are created based on time resolution, with a 
+    HistogramAccumulator. The list h_k is not modified.
+
+    Parameters:
+        h_k: list with channel impulse response [h_0,h_1,...,h_k]. 
+        k_reflec: number of reflections
+        no_cells: number of points of model
+        overflow: policy for rays delayed beyond BINS_HIST, see histogram_rays
+        dtype: data type of the histograms, float16 is promoted to float32 (see 
+            propagation_dtype)
+
+    Returns: A List with the next parameters
+        hist_power_time: Power histograms for each reflection
+        total_ht: total power CIR histrogram 
+        time_scale: 1d-array with time scale
+
+    """
+        
+    accumulator = HistogramAccumulator(k_reflec,delay_los=h_k[0][0,1],overflow=overflow,dtype=dtype)
 
+    for i in range(k_reflec+1):
+        accumulator.add(i,h_k[i][:,0],h_k[i][:,1])
+
+    hist_power_time,total_ht,time_scale = accumulator.finalize()
 
     return hist_power_time,total_ht,time_scale
 
@@ -560,6 +2986,8 @@ def compute_freq(
         xf: frequency scale
     """
 
+    from scipy.fft import rfft, rfftfreq
+
     hist_power_freq = np.zeros((int(BINS_HIST/2)+1,k_reflec+1))
     xf = rfftfreq(BINS_HIST, TIME_RESOLUTION)
 
@@ -572,66 +3000,786 @@ def compute_freq(
     return hist_power_freq,xf
 
 
+def compute_freq_response(
+    m: float,
+    tx_pos: List[float],
+    rx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    no_xtick: float,
+    no_ytick: float,
+    no_ztick: float,
+    init_index: float,
+    a_r: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: float,
+    freq: List[float],
+    tol: float = REFLECTION_TOLERANCE,
+    implicit: bool = False,
+    tx_normal: List[float] = None,
+    rx_normal: List[float] = None,
+    fov: float = np.pi/2,
+    concentrator: float = None,
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float]]:
+    """Function to compute the frequency response H(f) for each reflection without rays.
+    
+    The transfer matrix between cells G(f) = dP_ij*exp(-j2*pi*f*d_ij/c) is 
+    applied to the source vector once per reflection, so the response of the 
+    reflection k is h0_se(f)*G(f)**(k-1)*h0_er(f). The phase is referred to 
+    the line of sight delay, as in the histograms of create_histograms.
+
+    Parameters:
+        m,tx_pos,...,delta_A: same parameters of compute_cir
+        k_reflec: number of reflections, if it is None reflections are added 
+            until the last one is lower than tol times the accumulated response
+        freq: 1d-array with the frequencies [Hz] to evaluate
+        tol: relative tolerance used when k_reflec is None 
+        implicit: if it is True G(f) is applied with a ToeplitzOperator instead
+            of the dense matrix, it needs an uniform tessellation and the 
+            parameters array is not used (it can be None). The geometric 
+            kernels are computed once, each frequency costs one FFT of the 
+            kernels of every pair of walls
+        tx_normal,rx_normal,fov,concentrator,dtype: same parameters of compute_cir
+
+    Returns:
+        hfreq: 2d-array (freqs x reflections) with the complex response of each reflection
+        freq: frequency scale
+
+    """
+
+    dtype = propagation_dtype(dtype)
+
+    freq = np.atleast_1d(np.asarray(freq,dtype=np.float64))
+
+    h_los,h0_se,h0_er,dP_ij = compute_link_terms(m,tx_pos,rx_pos,points,wall_label,None if implicit else parameters,
+        x_lim,y_lim,z_lim,a_r,rho,delta_A,tx_normal=tx_normal,rx_normal=rx_normal,fov=fov,concentrator=concentrator,dtype=dtype)
+    
+    complex_dtype = np.result_type(dtype,np.complex64)
+    if implicit:
+        operator = ToeplitzOperator(points,wall_label,rho,delta_A)
+    else:
+        delay_ij = (parameters[0,:,:].astype(np.float64)/SPEED_OF_LIGHT).astype(dtype)
+    max_reflec = MAX_REFLECTIONS if k_reflec is None else k_reflec
+    
+    h_orders = []
+
+    for f in freq:
+        #the line of sight is the phase reference
+        phase_los = np.exp(2j*np.pi*f*h_los[1])
+        h_f = [complex(h_los[0])]
+        
+        if max_reflec > 0:
+            if implicit:
+                G_f = operator.at_freq(f)
+            else:
+                G_f = (dP_ij*np.exp(-2j*np.pi*f*delay_ij).astype(complex_dtype)).T
+            h_er = h0_er[:,0]*np.exp(-2j*np.pi*f*h0_er[:,1])
+            x_f = h0_se[:,0]*np.exp(-2j*np.pi*f*h0_se[:,1])
+
+        for i in range(1,max_reflec+1):
+            if i > 1:
+                x_f = G_f @ x_f
+
+            h_f.append(np.dot(x_f,h_er)*phase_los)
+            
+            if k_reflec is None and np.abs(h_f[-1]) <= tol*np.abs(np.sum(h_f)):
+                break
+
+        h_orders.append(h_f)
+
+    hfreq = np.zeros((len(freq),max(len(h_f) for h_f in h_orders)),dtype=np.complex128)
+    for j,h_f in enumerate(h_orders):
+        hfreq[j,:len(h_f)] = h_f
+
+    return hfreq,freq
+
+
+def compute_freq_response_mimo(
+    transmitters: Transmitters,
+    receivers: Receivers,
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: int,
+    freq: List[float],
+    implicit: bool = False,
+    dtype: type = np.float32
+    ) -> Tuple[List[float],List[float]]:
+    """Function to compute the frequency response H(f) of every transmitter and receiver pair.
+
+    The transfer matrix G(f) of compute_freq_response is applied once per 
+    reflection to the (cells x Nt) matrix with the source vectors of every 
+    transmitter, and the response of all the pairs is the matrix product with 
+    the (cells x Nr) receiver vectors. The phase is referred to t=0, so the 
+    relative delay between pairs is kept.
+
+    Parameters:
+        transmitters: Transmitters array
+        receivers: Receivers array
+        points,wall_label,parameters,x_lim,...,delta_A: same parameters of compute_cir
+        k_reflec: number of reflections
+        freq: 1d-array with the frequencies [Hz] to evaluate
+        implicit: same parameter of compute_freq_response
+        dtype: data type of the link terms and G(f), see propagation_dtype
+
+    Returns:
+        hfreq: 4d-array (freqs x Nt x Nr x reflections) with the complex response of each reflection
+        freq: frequency scale
+
+    """
+
+    dtype = propagation_dtype(dtype)
+    complex_dtype = np.result_type(dtype,np.complex64)
+    freq = np.atleast_1d(np.asarray(freq,dtype=np.float64))
+
+    se_power,se_delay = transmitter_terms(transmitters,points,wall_label,x_lim,y_lim,z_lim,rho,delta_A,dtype)
+    er_power,er_delay = receiver_terms(receivers,points,wall_label,dtype)
+    los_power,delay_los = los_terms(transmitters,receivers)
+
+    if implicit and k_reflec > 1:
+        operator = ToeplitzOperator(points,wall_label,rho,delta_A)
+    elif k_reflec > 1:
+        dP_ij = transfer_matrix(parameters,rho,delta_A,dtype)
+        delay_ij = (parameters[0,:,:].astype(np.float64)/SPEED_OF_LIGHT).astype(dtype)
+
+    hfreq = np.zeros((len(freq),transmitters.no_transmitters,receivers.no_receivers,k_reflec+1),dtype=np.complex128)
+
+    for j,f in enumerate(freq):
+        hfreq[j,:,:,0] = los_power*np.exp(-2j*np.pi*f*delay_los)
+        
+        if k_reflec == 0:
+            continue
+
+        if k_reflec > 1:
+            if implicit:
+                G_f = operator.at_freq(f)
+            else:
+                G_f = (dP_ij*np.exp(-2j*np.pi*f*delay_ij).astype(complex_dtype)).T
+        h_er = er_power*np.exp(-2j*np.pi*f*er_delay)
+        x_f = se_power*np.exp(-2j*np.pi*f*se_delay)
+
+        for i in range(1,k_reflec+1):
+            if i > 1:
+                x_f = G_f @ x_f
+
+            hfreq[j,:,:,i] = x_f.T @ h_er
+
+    return hfreq,freq
+
+
+def coverage_grid(
+    x_lim: float,
+    y_lim: float,
+    height: float,
+    spacing: float
+    ) -> Tuple[List[float],List[float],List[float]]:
+    """Function to create a grid of receiver positions in a plane at a given height.
+
+    The grid points are the centroids of square cells of side spacing, as in 
+    the tessellation of the walls.
+
+    Returns:
+        x_scale: 1d-array with the x coordinates of the grid
+        y_scale: 1d-array with the y coordinates of the grid
+        position: 2d-array (Nrx3) with [x,y,z] position of each grid point, 
+            the y coordinate changes faster
+    
+    """
+
+    x_scale = spacing/2 + np.arange(int(round(x_lim/spacing)))*spacing
+    y_scale = spacing/2 + np.arange(int(round(y_lim/spacing)))*spacing
+    grid_x,grid_y = np.meshgrid(x_scale,y_scale,indexing="ij")
+    position = np.stack([grid_x.ravel(),grid_y.ravel(),np.full(grid_x.size,height)],axis=1)
+
+    return x_scale,y_scale,position
+
+
+def coverage_map(
+    m: float,
+    tx_pos: List[float],
+    points: List[float],
+    wall_label: List[float],
+    parameters: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    a_r: float,
+    rho: float,
+    delta_A: float,
+    k_reflec: int,
+    height: float,
+    spacing: float,
+    fov: float = np.pi/2,
+    freq: List[float] = None,
+    block_size: int = None,
+    tx_normal: List[float] = None,
+    concentrator: float = None
+    ) -> Tuple[List[float],List[float],List[float],List[float],List[float]]:
+    """Function to compute the DC gain, RMS delay spread and 3 dB bandwidth over a receiver plane.
+
+    The receivers face up on a grid at the given height. The walls are solved 
+    once from the source: the power, power*delay and power*delay**2 of the 
+    paths arriving at each cell are propagated through dP_ij and summed over 
+    the reflections, as well as the source vector in frequency domain 
+    sum(G(f)**(i-1)*h0_se(f)). The receivers are then evaluated by blocks 
+    with matrix products against the cell to receiver factors, so no ray or 
+    histogram is created. The delays are exact, not binned. The link terms, 
+    dP_ij, the moments and the frequency responses are computed in float64, 
+    with no precision policy.
+
+    The cost is dominated by the frequency responses of the receivers, one 
+    product of (cells x receivers) phasors per frequency. When freq is an 
+    uniform scale the phasors are advanced with the recurrence 
+    exp(-2j*pi*(f+df)*t) = exp(-2j*pi*f*t)*exp(-2j*pi*df*t), so only two 
+    complex exponentials are evaluated per block instead of one per frequency.
+
+    The 3 dB bandwidth is the first frequency where |H(f)|**2 falls to half 
+    of the DC gain squared, linearly interpolated between the frequencies of 
+    freq. It is inf when the response does not fall below that level.
+
+    Parameters:
+        m,tx_pos,points,wall_label,parameters,x_lim,...,k_reflec: same parameters of compute_cir
+        height: z coordinate of the receiver plane
+        spacing: distance between grid points
+        fov: half-angle field of view [rad] of the receivers
+        freq: 1d-array with the frequencies [Hz] used to find the bandwidth, by 
+            default the frequency scale of compute_freq
+        block_size: number of (cell,receiver) pairs evaluated at once, by 
+            default COVERAGE_BLOCK_SIZE
+        tx_normal: normal vector of the source, see compute_link_terms
+        concentrator: refractive index of the concentrator of the receivers
+
+    Returns:
+        dc_gain: 2d-array (Nx x Ny) with the total power of each grid point
+        rms_delay: 2d-array (Nx x Ny) with the RMS delay spread [s]
+        bandwidth: 2d-array (Nx x Ny) with the 3 dB bandwidth [Hz]
+        x_scale,y_scale: 1d-arrays with the coordinates of the grid
+
+    """
+
+    freq = np.fft.rfftfreq(BINS_HIST,TIME_RESOLUTION) if freq is None else np.atleast_1d(np.asarray(freq,dtype=np.float64))
+    
+    x_scale,y_scale,position = coverage_grid(x_lim,y_lim,height,spacing)
+    receivers = make_receivers(position,[0,0,1],a_r,fov,concentrator)
+    no_cells = len(points[0,:])
+
+    if block_size is None:
+        block_size = COVERAGE_BLOCK_SIZE
+    block_rx = max(1,block_size//no_cells)
+
+    transmitter,h0_se,dP_ij = source_terms(m,tx_pos,points,wall_label,parameters,x_lim,y_lim,z_lim,rho,delta_A,tx_normal,np.float64)
+    los_power,delay_los = los_terms(transmitter,receivers)
+    los_power,delay_los = los_power[0],delay_los[0]
+
+    #moments of the delay of the paths arriving at each cell, summed over reflections
+    delay_ij = parameters[0,:,:].astype(np.float64)/SPEED_OF_LIGHT
+    dP_ij = dP_ij.astype(np.float64)
+    moments = np.stack([h0_se[:,0],h0_se[:,0]*h0_se[:,1],h0_se[:,0]*h0_se[:,1]**2],axis=1).astype(np.float64)
+    sum_moments = np.zeros((no_cells,3)) if k_reflec == 0 else moments.copy()
+    if k_reflec > 1:
+        power_delay = (dP_ij*delay_ij).T
+        power_delay2 = power_delay*delay_ij.T
+    
+    for i in range(2,k_reflec+1):
+        moments = np.stack([
+            dP_ij.T @ moments[:,0],
+            dP_ij.T @ moments[:,1] + power_delay @ moments[:,0],
+            dP_ij.T @ moments[:,2] + 2*power_delay @ moments[:,1] + power_delay2 @ moments[:,0]],axis=1)
+        sum_moments += moments
+
+    #phasors are advanced by a recurrence when the frequency scale is uniform
+    uniform = len(freq) > 1 and np.allclose(np.diff(freq),freq[1]-freq[0],rtol=1e-9,atol=0)
+    step_freq = freq[1]-freq[0] if uniform else None
+
+    #source vectors in frequency domain, summed over reflections
+    sum_freq = np.zeros((no_cells,len(freq)),dtype=np.complex128)
+    if k_reflec > 0:
+        if k_reflec > 1:
+            phase_ij = np.exp(-2j*np.pi*freq[0]*delay_ij)
+            step_ij = np.exp(-2j*np.pi*step_freq*delay_ij) if uniform else None
+        for j,f in enumerate(freq):
+            x_f = h0_se[:,0]*np.exp(-2j*np.pi*f*h0_se[:,1].astype(np.float64))
+            sum_freq[:,j] = x_f
+            if k_reflec > 1:
+                if j > 0:
+                    phase_ij = phase_ij*step_ij if uniform else np.exp(-2j*np.pi*f*delay_ij)
+                G_f = (dP_ij*phase_ij).T
+                for i in range(2,k_reflec+1):
+                    x_f = G_f @ x_f
+                    sum_freq[:,j] += x_f
+
+    dc_gain = np.zeros(receivers.no_receivers)
+    rms_delay = np.zeros(receivers.no_receivers)
+    bandwidth = np.full(receivers.no_receivers,np.inf)
+
+    for ini in range(0,receivers.no_receivers,block_rx):
+        block = slice(ini,ini+block_rx)
+        er_power,er_delay = receiver_terms(receivers.take(block),points,wall_label,np.float64)
+        er_power,er_delay = er_power.astype(np.float64),er_delay.astype(np.float64)
+        er_power_delay = er_power*er_delay
+
+        power = sum_moments[:,0] @ er_power + los_power[block]
+        mean = sum_moments[:,1] @ er_power + sum_moments[:,0] @ er_power_delay + los_power[block]*delay_los[block]
+        square = (sum_moments[:,2] @ er_power + 2*sum_moments[:,1] @ er_power_delay + sum_moments[:,0] @ (er_power_delay*er_delay)
+            + los_power[block]*delay_los[block]**2)
+        
+        mean = np.divide(mean,power,out=np.zeros_like(power),where=power>0)
+        square = np.divide(square,power,out=np.zeros_like(power),where=power>0)
+        dc_gain[block] = power
+        rms_delay[block] = np.sqrt(np.clip(square - mean**2,0,None))
+
+        hfreq = np.zeros((len(power),len(freq)),dtype=np.complex128)
+        er_phasor = er_power*np.exp(-2j*np.pi*freq[0]*er_delay)
+        er_step = np.exp(-2j*np.pi*step_freq*er_delay) if uniform else None
+        for j,f in enumerate(freq):
+            if j > 0 and uniform:
+                er_phasor *= er_step
+            elif j > 0:
+                er_phasor = er_power*np.exp(-2j*np.pi*f*er_delay)
+            hfreq[:,j] = sum_freq[:,j] @ er_phasor + los_power[block]*np.exp(-2j*np.pi*f*delay_los[block])
+        
+        ratio = np.divide(np.abs(hfreq)**2,power[:,np.newaxis]**2,out=np.ones_like(hfreq,dtype=np.float64),where=power[:,np.newaxis]>0)
+        below = ratio <= 0.5
+        first = np.argmax(below,axis=1)
+        rows = np.nonzero(np.any(below,axis=1))[0]
+        after,before = first[rows],np.maximum(first[rows]-1,0)
+        
+        #linear interpolation of the half power level between the last frequency above it and the first below
+        slope = np.divide(freq[after]-freq[before],ratio[rows,after]-ratio[rows,before],
+            out=np.zeros(len(rows)),where=after!=before)
+        block_bandwidth = np.full(len(power),np.inf)
+        block_bandwidth[rows] = freq[before] + (0.5 - ratio[rows,before])*slope
+        block_bandwidth[power==0] = np.nan
+        bandwidth[block] = block_bandwidth
+
+    shape = (len(x_scale),len(y_scale))
+    print("//------------- coverage map computed --------//")
+
+    return dc_gain.reshape(shape),rms_delay.reshape(shape),bandwidth.reshape(shape),x_scale,y_scale
+
+
+def precision_report(
+    m: float,
+    tx_pos: List[float],
+    rx_pos: List[float],
+    x_lim: float,
+    y_lim: float,
+    z_lim: float,
+    scale_factor: float,
+    a_r: float,
+    rho: float,
+    k_reflec: int,
+    dtypes: List[str] = PRECISIONS,
+    power_budget: float = 1e-3,
+    delay_budget: float = TIME_RESOLUTION,
+    report: bool = True,
+    **kwargs
+    ) -> dict:
+    """Function to compare the precision policies with a float64 reference.
+
+    The model (tessellation, parameters, propagation of the rays and 
+    histograms) is computed with each data type and with float64, and the 
+    errors of the channel impulse response are reported:
+        power_error: maximum error of the power of a reflection, relative to 
+            the total power of the reference
+        delay_error: maximum error [s] of the mean delay of a reflection
+        hist_error: L1 error of the total histogram, relative to the 
+            reference
+
+    Parameters:
+        m,tx_pos,rx_pos,x_lim,y_lim,z_lim,scale_factor,a_r,rho,k_reflec: 
+            same parameters of the model
+        dtypes: data types to compare ('float16', 'float32' or 'float64')
+        power_budget: maximum power_error of a valid data type
+        delay_budget: maximum delay_error [s] of a valid data type
+        report: if it is True the table of errors is printed
+        kwargs: parameters of iter_cir, tx_normal, rx_normal, fov, ...
+
+    Returns: A dict with the errors, the memory of the parameters [bytes] and 
+        the execution time [s] of each data type, and the cheapest data type 
+        inside the budgets in "choice".
+
+    """
+
+    def run(dtype):
+        starttime = timeit.default_timer()
+        array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = tessellation(x_lim,y_lim,z_lim,scale_factor,dtype=dtype)
+        parameters = make_parameters(array_points,x_lim,y_lim,z_lim,no_xtick,no_ytick,no_ztick,dtype=dtype)
+        
+        power = np.zeros(k_reflec+1)
+        power_delay = np.zeros(k_reflec+1)
+        accumulator = None
+        for order,power_chunk,delay_chunk in iter_cir(m,tx_pos,rx_pos,array_points[0:3,:],array_points[3,:],parameters,
+                x_lim,y_lim,z_lim,no_xtick,no_ytick,no_ztick,init_index,a_r,rho,delta_A,k_reflec,dtype=dtype,**kwargs):
+            power_chunk = power_chunk.astype(np.float64)
+            delay_chunk = delay_chunk.astype(np.float64)
+            if accumulator is None:
+                accumulator = HistogramAccumulator(k_reflec,delay_los=delay_chunk[0])
+            accumulator.add(order,power_chunk,delay_chunk)
+            power[order] += np.sum(power_chunk)
+            power_delay[order] += np.dot(power_chunk,delay_chunk)
+        
+        hist_power_time,total_ht,time_scale = accumulator.finalize(report=False)
+        mean_delay = np.divide(power_delay,power,out=np.zeros_like(power),where=power!=0)
+        
+        return {"power":power,"mean_delay":mean_delay,"total_ht":total_ht,
+            "parameters_bytes":parameters.nbytes,"time":timeit.default_timer() - starttime}
+
+    reference = run(np.float64)
+    results = {}
+
+    for name in dtypes:
+        result = reference if np.dtype(name) == np.float64 else run(np.dtype(name))
+        total_power = np.sum(reference["power"])
+        results[name] = {
+            "power_error":float(np.max(np.abs(result["power"] - reference["power"]))/total_power) if total_power > 0 else 0.0,
+            "delay_error":float(np.max(np.abs(result["mean_delay"] - reference["mean_delay"]))),
+            "hist_error":float(np.sum(np.abs(result["total_ht"] - reference["total_ht"]))/np.sum(reference["total_ht"])) 
+                if np.sum(reference["total_ht"]) > 0 else 0.0,
+            "parameters_bytes":result["parameters_bytes"],
+            "time":result["time"]}
+
+    valid = [name for name in dtypes if results[name]["power_error"] <= power_budget and results[name]["delay_error"] <= delay_budget]
+    results["choice"] = min(valid,key=lambda name: np.dtype(name).itemsize) if valid else None
+
+    if report:
+        print("//------------- Precision report ------------------//")
+        print("Reference: float64")
+        print("Budget: power_error<="+str(power_budget)+" delay_error[s]<="+str(delay_budget))
+        print("%-8s %12s %14s %12s %12s %10s" % ("dtype","power_error","delay_error[s]","hist_error","params[MB]","time[s]"))
+        for name in dtypes:
+            r = results[name]
+            print("%-8s %12.3e %14.3e %12.3e %12.2f %10.2f" % (name,r["power_error"],r["delay_error"],r["hist_error"],
+                r["parameters_bytes"]/2**20,r["time"]))
+        print("Choice:",results["choice"])
+
+    return results
+
+
+def save_result(
+    name: str,
+    columns: dict,
+    path: str = CIR_PATH,
+    output_format: str = OUTPUT_FORMAT,
+    metadata: dict = None,
+    dtype: type = np.float32
+    ) -> str:
+    """Function to save a result with named columns of the same length.
+
+    The formats are:
+        'npy': name.npy with a 2d-array (columns x rows) of dtype, so each 
+            column is contiguous and it is loaded as a memmap by load_result
+        'npz': name.npz with a compressed array of dtype for each column
+        'csv': name.csv with a text row per element, as numpy.savetxt
+    A name.json header with the columns, rows, dtype and metadata is written 
+    with the binary formats. The file is written in a temporary file and 
+    renamed when it is complete.
+
+    Parameters:
+        name: name of the result, without extension
+        columns: dict with the 1d-array (or any array, it is flattened) of 
+            each column, in order
+        path: directory of the result
+        output_format: 'npy', 'npz' or 'csv'
+        metadata: optional dict saved in the header
+        dtype: data type of the columns in the binary formats
+
+    Returns: The path of the result file.
+
+    """
+
+    os.makedirs(path,exist_ok=True)
+    names = list(columns)
+    data = [np.ravel(columns[column]) for column in names]
+    
+    if output_format == "csv":
+        result_file = os.path.join(path,name+".csv")
+        numpy.savetxt(result_file,np.transpose(data),delimiter=",")
+        return result_file
+    elif output_format not in ["npy","npz"]:
+        raise ValueError("Unknown output format: "+str(output_format))
+
+    result_file = os.path.join(path,name+"."+output_format)
+    temp_file = result_file+".tmp"
+
+    with open(temp_file,"wb") as file:
+        if output_format == "npy":
+            np.save(file,np.array(data,dtype=dtype).reshape(len(names),-1))
+        else:
+            np.savez_compressed(file,**{column:array.astype(dtype) for column,array in zip(names,data)})
+    os.replace(temp_file,result_file)
+
+    header = {
+        "format":output_format,"columns":names,"rows":len(data[0]) if data else 0,
+        "dtype":np.dtype(dtype).name,"metadata":{} if metadata is None else metadata
+        }
+    with open(os.path.join(path,name+".json"),"w") as file:
+        json.dump(header,file,indent=2)
+
+    return result_file
+
+
+def load_result(
+    name: str,
+    path: str = CIR_PATH
+    ) -> Tuple[dict,dict]:
+    """Function to load a result of save_result in a binary format.
+
+    The columns of a 'npy' result are read-only memmaps of the file, without 
+    copying it to memory. The columns of a 'npz' result are decompressed.
+
+    Returns: A list with the next parameters
+        columns: dict with the 1d-array of each column
+        header: dict with the header of the result
+
+    """
+
+    with open(os.path.join(path,name+".json")) as file:
+        header = json.load(file)
+
+    if header["format"] == "npy":
+        data = np.load(os.path.join(path,name+".npy"),mmap_mode="r")
+        columns = {column:data[i] for i,column in enumerate(header["columns"])}
+    else:
+        with np.load(os.path.join(path,name+".npz")) as data:
+            columns = {column:data[column] for column in header["columns"]}
+
+    return columns,header
+
+
+def export_csv(
+    name: str,
+    path: str = CIR_PATH,
+    csv_file: str = None
+    ) -> str:
+    """Function to convert a binary result of save_result to a .csv file, with a row per element.
+
+    Returns: The path of the .csv file, by default name.csv in the directory of the result.
+
+    """
+
+    columns,header = load_result(name,path)
+    csv_file = os.path.join(path,name+".csv") if csv_file is None else csv_file
+    numpy.savetxt(csv_file,np.transpose([columns[column] for column in header["columns"]]),delimiter=",")
+
+    return csv_file
+
+
+class ResultWriter:
+    """Background writer of results with a bounded queue of tasks.
+
+    The tasks (save_result or any function, like fig.savefig) are run in 
+    order by a thread, so the next reflection or simulation is computed while 
+    the previous results are written. submit blocks when max_queue tasks are 
+    pending. flush waits until every submitted task is done and raises the 
+    first error of the tasks. The arrays given to the writer must not be 
+    modified until they are written.
+
+        with ResultWriter() as writer:
+            h_k = compute_cir(...,writer=writer)
+            create_hfiles(h_k,k_reflec,writer=writer)
+
+    """
+
+    def __init__(
+        self,
+        max_queue: int = WRITER_QUEUE_SIZE
+        ) -> None:
+
+        self.tasks = queue.Queue(maxsize=max_queue)
+        self.errors = []
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+
+    def run(self) -> None:
+        """Method of the writer thread, it runs the tasks until it gets None."""
+
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                function,args,kwargs = task
+                function(*args,**kwargs)
+            except Exception as error:
+                self.errors.append(error)
+            finally:
+                self.tasks.task_done()
+
+
+    def submit(self,function,*args,**kwargs) -> None:
+        """Method to add the task function(*args,**kwargs) to the queue."""
+
+        if not self.thread.is_alive():
+            raise RuntimeError("The writer is closed.")
+        self.tasks.put((function,args,kwargs))
+
+
+    def save_result(self,*args,**kwargs) -> None:
+        """Method to call save_result in background, with the same parameters."""
+        self.submit(save_result,*args,**kwargs)
+
+
+    def flush(self) -> None:
+        """Method to wait until the submitted tasks are done."""
+
+        self.tasks.join()
+        if self.errors:
+            error = self.errors[0]
+            self.errors = []
+            raise error
+
+
+    def close(self) -> None:
+        """Method to flush the tasks and stop the thread."""
+
+        if self.thread.is_alive():
+            self.tasks.put(None)
+            self.thread.join()
+        self.flush()
+
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+
+    def __exit__(self,*exc) -> None:
+        self.close()
+
+
 def create_hfiles(
     h_k: List[float],
-    k_reflec: float
+    k_reflec: float,
+    output_format: str = OUTPUT_FORMAT,
+    writer: "ResultWriter" = None
     ) -> None:
-    """Function to create .csv of h(t) raw files channel impulse response."""
+    """Function to create the files hN of h(t) raw files channel impulse response, see save_result.
+    
+    If a ResultWriter is given, the files are written in background.
+
+    """
+
+    output = save_result if writer is None else writer.save_result
 
     for i in range(k_reflec+1):
-        numpy.savetxt(CIR_PATH+"h"+str(i)+".csv", h_k[i], delimiter=",") 
+        rays = np.reshape(h_k[i],(-1,2))
+        output("h"+str(i),{"power":rays[:,0],"delay":rays[:,1]},CIR_PATH,output_format,
+            metadata={"reflection":i,"shape":list(np.shape(h_k[i]))})
     
     return 0
 
-#Function to create .csv files and graphs of power histograms 
+def render_graph(
+    file: str,
+    x: List[float],
+    y: List[float],
+    xlabel: str,
+    title: str
+    ) -> str:
+    """Function to render a stem graph of a histogram in a .png file without display.
+    
+    The figure is drawn by the Agg canvas and it is not registered in pyplot, 
+    so no window is opened and the figure is released after it is saved. It 
+    can be run in a thread or a worker process.
+
+    Returns: The path of the file.
+
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    vax = fig.subplots(1, 1)
+    vax.plot(x, y, 'o',markersize=2)
+    vax.vlines(x, [0], y,linewidth=1)
+
+    vax.set_xlabel(xlabel+" \n Time resolution:"+str(TIME_RESOLUTION)+"s  Bins:"+str(BINS_HIST),fontsize=15)
+    vax.set_ylabel('Power(W)',fontsize=15)
+    vax.set_title(title,fontsize=20)
+
+    vax.grid(color = 'black', linestyle = '--', linewidth = 0.5)
+    
+    fig.savefig(file)
+    fig.clear()
+
+    return file
+
+
+#Function to create files and graphs of power histograms 
 def create_histfiles(
     hist_power_time: List[float],
     time_scale: List[float],
     k_reflec: float,
     hfreq: List[float],
-    freq: List[float]
+    freq: List[float],
+    output_format: str = OUTPUT_FORMAT,
+    writer: "ResultWriter" = None,
+    graphs: bool = True,
+    workers: int = 1
     ) -> None:
-    """Function to create .csv and graphs of h(t) histogram channel impulse response."""
+    """Function to create files (see save_result) and graphs of h(t) histogram channel impulse response.
     
-    print("//--- creating-histograms-files-csv-graphs ---//")            
-
-    for i in range(k_reflec+1):
-        fig, (vax) = plt.subplots(1, 1, figsize=(12, 6))
-        vax.plot(time_scale,hist_power_time[:,i], 'o',markersize=2)
-        vax.vlines(time_scale, [0], hist_power_time[:,i],linewidth=1)
-
-        vax.set_xlabel("time(s) \n Time resolution:"+str(TIME_RESOLUTION)+"s  Bins:"+str(BINS_HIST),fontsize=15)
-        vax.set_ylabel('Power(W)',fontsize=15)
-        vax.set_title("Channel Impulse Response h"+str(i)+"(t)",fontsize=20)
-
-        vax.grid(color = 'black', linestyle = '--', linewidth = 0.5)
-        
-        numpy.savetxt(REPORT_PATH+"h"+str(i)+"-histogram.csv", np.transpose([hist_power_time[:,i],time_scale.T]), delimiter=",") 
+    The graphs of the time and frequency histograms of each reflection are 
+    rendered without display by render_graph. If a ResultWriter is given, the 
+    files (and the graphs if workers is 1) are written in background.
 
-        fig.savefig(REPORT_PATH+"h"+str(i)+".png")        
-        plt.show()
+    Parameters:
+        hist_power_time,time_scale: power histograms and time scale of create_histograms
+        k_reflec: number of reflections
+        hfreq,freq: frequency histograms and frequency scale of compute_freq
+        output_format: format of the files, see save_result
+        writer: optional ResultWriter
+        graphs: if it is False only the files are created (data-only)
+        workers: number of processes that render the graphs, None uses every 
+            core, they are started as in make_parameters
 
-    numpy.savetxt(REPORT_PATH+"total-histogram.csv", np.transpose([np.sum(hist_power_time,axis=1),time_scale.T]), delimiter=",") 
+    """
 
+    output = save_result if writer is None else writer.save_result
     
-    for i in range(k_reflec+1):
-        fig, (vax) = plt.subplots(1, 1, figsize=(12, 6))
-        vax.plot(freq, hfreq[:,i],'o',markersize=2)
-        vax.vlines(freq, [0], hfreq[:,i],linewidth=1)
+    print("//--- creating-histograms-files-csv-graphs ---//")            
 
-        vax.set_xlabel("Freq(Hz) \n Time resolution:"+str(TIME_RESOLUTION)+"s  Bins:"+str(BINS_HIST),fontsize=15)
-        vax.set_ylabel('Power(W)',fontsize=15)
-        vax.set_title("Frequency CIR h"+str(i),fontsize=20)
+    tasks = []
 
-        vax.grid(color = 'black', linestyle = '--', linewidth = 0.5)
-        
-        numpy.savetxt(REPORT_PATH+"h"+str(i)+"-freq-histogram.csv", [hfreq[:,i],freq], delimiter=",") 
+    for i in range(k_reflec+1):
+        output("h"+str(i)+"-histogram",{"power":hist_power_time[:,i],"time":time_scale},REPORT_PATH,output_format)
+        tasks.append((REPORT_PATH+"h"+str(i)+".png",time_scale,hist_power_time[:,i],"time(s)","Channel Impulse Response h"+str(i)+"(t)"))
 
-        fig.savefig(REPORT_PATH+"h"+str(i)+"freq.png")        
-        plt.show()
+    output("total-histogram",{"power":np.sum(hist_power_time,axis=1),"time":time_scale},REPORT_PATH,output_format)
 
+    for i in range(k_reflec+1):
+        output("h"+str(i)+"-freq-histogram",{"power":hfreq[:,i],"freq":freq},REPORT_PATH,output_format)
+        tasks.append((REPORT_PATH+"h"+str(i)+"freq.png",freq,hfreq[:,i],"Freq(Hz)","Frequency CIR h"+str(i)))
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    if not graphs:
+        pass
+    elif workers > 1:
+        with multiprocessing.get_context(POOL_START_METHOD).Pool(min(workers,len(tasks))) as pool:
+            pool.starmap(render_graph,tasks)
+    elif writer is not None:
+        for task in tasks:
+            writer.submit(render_graph,*task)
+    else:
+        for task in tasks:
+            render_graph(*task)
     
-    print("Graphs and CSV created and saved in directory.")
+    print("Graphs and files created and saved in directory.")
 
     return 0
 
@@ -655,7 +3803,7 @@ if __name__ == "__main__":
 
     array_points,no_xtick,no_ytick,no_ztick,init_index,delta_A,no_points = tessellation(e[2][0],e[2][1],e[2][2],e[1])
     #ew_par = make_parameters(array_points,e[2][0],e[2][1],e[2][2],no_xtick,no_ytick,no_ztick)
-    #h_k = compute_cir(s[2],s[0],r[0],array_points[0:3,:],array_points[3,:],ew_par,e[2][0],e[2][1],e[2][2],no_xtick,no_ytick,no_ztick,init_index,r[2],e[0],delta_A,e[3])
+    #h_k = compute_cir(s[2],s[0],r[0],array_points[0:3,:],array_points[3,:],ew_par,e[2][0],e[2][1],e[2][2],no_xtick,no_ytick,no_ztick,init_index,r[2],e[0],delta_A,e[3],tx_normal=s[1],rx_normal=r[1],fov=r[3])
     #hist_power_time,total_ht,time_scale = create_histograms(h_k,e[3],no_points)
     #hfreq,freq = compute_freq(hist_power_time,e[3])
 